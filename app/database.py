@@ -1,25 +1,86 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from .services.metrics import metrics, METRICS_ENABLED
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
 # For local development if DATABASE_URL is missing, use a local sqlite (optional fallback)
 if not SQLALCHEMY_DATABASE_URL:
     SQLALCHEMY_DATABASE_URL = "sqlite:///./forge_audio.db"
 
+# Connection pool settings (Postgres); pre-ping and recycle drop connections the
+# server or a proxy closed while they sat idle in the pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": True,
+}
+
+
+def _async_database_url(url):
+    """Same database through an asyncio driver: asyncpg for Postgres, aiosqlite for SQLite."""
+    url = make_url(url.replace("postgres://", "postgresql://", 1))
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    url = url.set(drivername="postgresql+asyncpg")
+    # asyncpg takes `ssl` where libpq takes `sslmode`
+    if "sslmode" in url.query:
+        url = url.difference_update_query(["sslmode"]).update_query_dict({"ssl": url.query["sslmode"]})
+    return url
+
+
 # engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}) # only for sqlite
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(_async_database_url(SQLALCHEMY_DATABASE_URL))
 else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, **POOL_OPTIONS)
+    async_engine = create_async_engine(_async_database_url(SQLALCHEMY_DATABASE_URL), **POOL_OPTIONS)
+
+DB_QUERY_SECONDS = metrics.histogram("forge_db_query_seconds", "Database statement latency", ["driver", "operation"])
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
 
+def _instrument(sync_engine, driver):
+    """Time every statement `sync_engine` executes (async engines run through their sync core)."""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, so a failed statement leaves nothing behind
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start
+        operation = statement.lstrip()[:6].upper()
+        DB_QUERY_SECONDS.observe(elapsed, driver=driver, operation=operation if operation in _OPERATIONS else "OTHER")
+
+
+if METRICS_ENABLED:
+    _instrument(engine, "sync")
+    _instrument(async_engine.sync_engine, "async")
+
+# Sync sessions for separation threads and worker processes
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async sessions for request handlers; nothing blocks the event loop on a DB round trip
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Dependency to get DB session
@@ -29,3 +90,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get an async DB session (API routes)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -12,21 +13,18 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Create directories if they don't exist
-# Use /tmp for writable storage in serverless/container environments
-import tempfile
-BASE_TEMP_DIR = os.path.join(tempfile.gettempdir(), "forge_audio")
-UPLOADS_DIR = os.path.join(BASE_TEMP_DIR, "uploads")
-STEMS_DIR = os.path.join(BASE_TEMP_DIR, "stems")
+# Create directories if they don't exist (layout and location: services.storage)
+from .services.storage import storage, UPLOADS_DIR
+storage.ensure_layout()
 
-os.makedirs(UPLOADS_DIR, exist_ok=True)
-os.makedirs(STEMS_DIR, exist_ok=True)
-
-# Serve static files for audio stems
-app.mount("/stems", StaticFiles(directory=STEMS_DIR), name="stems")
+# Stems are served by routes.stems (ranges, ETags, immutable caching)
 app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
 
-from .routes import upload, jobs, download
+from .routes import upload, jobs, download, stems, metrics
+from .utils.body_limit import BodySizeLimitMiddleware
+
+# Multipart upload bodies are capped as they arrive; added before CORS so refusals still carry CORS headers
+app.add_middleware(BodySizeLimitMiddleware, limits=upload.BODY_LIMITS)
 
 # Configure CORS
 raw_origins = os.getenv("CORS_ORIGINS", "*")
@@ -58,12 +56,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the browser player and resumable uploader read these cross-origin
+    expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "ETag", "Upload-Offset", "Location"],
 )
 
 # Register routes
 app.include_router(upload.router)
 app.include_router(jobs.router)
 app.include_router(download.router)
+app.include_router(stems.router)
+app.include_router(metrics.router)
+
+@app.on_event("startup")
+async def start_job_events():
+    from .services.job_events import job_events
+    job_events.start()
+
+@app.on_event("startup")
+async def start_lifecycle_collector():
+    from .services.lifecycle import lifecycle_collector
+    lifecycle_collector.start()
+
+@app.on_event("startup")
+async def preload_models():
+    # Warm the separator pool in the background so startup isn't blocked on model loads
+    from .services.model_pool import model_pool, PRELOAD_MODELS
+    if PRELOAD_MODELS:
+        print(f"[STARTUP] Preloading models: {PRELOAD_MODELS}")
+        asyncio.create_task(asyncio.to_thread(model_pool.preload, PRELOAD_MODELS))
+
+@app.on_event("shutdown")
+async def close_database():
+    from .database import async_engine
+    await async_engine.dispose()
+
+@app.on_event("shutdown")
+async def stop_analysis_pool():
+    from .services.analysis_executor import analysis_executor
+    analysis_executor.shutdown()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from ..database import Base
+
+class AnalysisResult(Base):
+    __tablename__ = "analysis_results"
+    __table_args__ = (
+        UniqueConstraint("job_id", "stem", "kind", "params_key", name="uq_analysis_results_lookup"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    stem = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # e.g. "chords"
+    params_key = Column(String, nullable=False)  # Canonical JSON of the analysis parameters
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<AnalysisResult job_id={self.job_id} stem={self.stem} kind={self.kind}>"
@@ -1,18 +1,34 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Float
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Float, Boolean, ForeignKey
 from sqlalchemy.sql import func
 from ..database import Base
+from .user import User  # noqa: F401  registers `users` for the user_id foreign key
 
 class Job(Base):
     __tablename__ = "jobs"
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
-    status = Column(String, default="pending")  # pending, processing, completed, failed
+    status = Column(String, default="pending", index=True)  # pending, processing, completed, failed, expired
     progress = Column(Float, default=0.0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     stems = Column(JSON, nullable=True)  # Store paths to separated stems: {"vocals": "...", "drums": "...", ...}
     error_message = Column(String, nullable=True)
+    timings = Column(JSON, nullable=True)  # Seconds per stage: {"decode": ..., "model_load": ..., "inference": ..., "write": ..., "pass2": ...}
+
+    # Durable queue bookkeeping (see app/services/job_queue.py)
+    input_path = Column(String, nullable=True)
+    high_quality = Column(Boolean, default=False)
+    attempts = Column(Integer, default=0, server_default="0")
+    worker_id = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Fair queuing between users (see app/services/scheduler.py)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    # Content-addressed result cache (see app/services/stem_cache.py)
+    audio_hash = Column(String, nullable=True, index=True)
+    cache_key = Column(String, nullable=True)
 
     def __repr__(self):
         return f"<Job id={self.id} filename={self.filename} status={self.status}>"
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, JSON, Boolean
+from sqlalchemy.sql import func
+from ..database import Base
+
+class StemCacheEntry(Base):
+    __tablename__ = "stem_cache"
+
+    cache_key = Column(String, primary_key=True)  # "<audio sha256>:<model+model>:<std|hq>"
+    audio_hash = Column(String, nullable=False, index=True)
+    models = Column(String, nullable=False)
+    high_quality = Column(Boolean, default=False)
+    source_job_id = Column(Integer, nullable=False)  # Job whose output directory holds the stems
+    stems = Column(JSON, nullable=False)
+    stems_dir = Column(String, nullable=False)
+    size_bytes = Column(BigInteger, default=0)
+    ref_count = Column(Integer, default=0)  # Jobs whose `stems` point into stems_dir
+    evicted = Column(Boolean, default=False)  # No longer served; directory removed once ref_count hits 0
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<StemCacheEntry key={self.cache_key} refs={self.ref_count} evicted={self.evicted}>"
@@ -1,16 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
 from ..models.job import Job
+from ..utils.http_files import file_response
+from ..services.transcoder import normalize_format, transcode, TranscodeError
+from ..services.archives import archive_path, build_archive
+from .stems import localize_stem
+import asyncio
 import os
-import zipstream
-import io
 
 router = APIRouter(prefix="/api/download", tags=["download"])
 
-@router.get("/{job_id}/all")
-async def export_all_stems(job_id: int, stems: str = None, db: Session = Depends(get_db)):
+def _requested_format(format):
+    if format is None:
+        return None
+    fmt = normalize_format(format)
+    if not fmt:
+        raise HTTPException(status_code=400, detail="Unsupported format. Allowed: wav, flac, opus (ogg), mp3")
+    return fmt
+
+
+@router.api_route("/{job_id}/all", methods=["GET", "HEAD"])
+async def export_all_stems(job_id: int, request: Request, stems: str = None, format: str = None, db: AsyncSession = Depends(get_async_db)):
     from urllib.parse import unquote
     requested_stems = None
     if stems:
@@ -19,46 +30,63 @@ async def export_all_stems(job_id: int, stems: str = None, db: Session = Depends
     else:
         print(f"[DOWNLOAD] Full ZIP export for Job {job_id}")
         
-    job = db.query(Job).filter(Job.id == job_id).first()
+    fmt = _requested_format(format)
+    job = await db.get(Job, job_id)
+    if job and job.status == "expired":
+        raise HTTPException(status_code=410, detail="Stems for this job have expired")
     if not job or not job.stems:
         raise HTTPException(status_code=404, detail="Stems not found for this job")
-    
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    stems_dir = os.path.join(base_dir, "stems", str(job_id))
-    
-    if not os.path.exists(stems_dir):
+
+    files = []
+    for stem_name, stem_path in job.stems.items():
+        # If a filter is provided, skip stems not in the list
+        if requested_stems and stem_name not in requested_stems:
+            continue
+        abs_path = await localize_stem(stem_path)
+        if abs_path:
+            files.append(abs_path)
+
+    if not files:
         raise HTTPException(status_code=404, detail="Stems directory not found")
 
-    def generator():
-        z = zipstream.ZipStream()
-        for stem_name, stem_path in job.stems.items():
-            # If a filter is provided, skip stems not in the list
-            if requested_stems and stem_name not in requested_stems:
-                continue
-                
-            filename = os.path.basename(stem_path)
-            abs_path = os.path.join(stems_dir, filename)
-            if os.path.exists(abs_path):
-                z.add_path(abs_path, arcname=filename)
-        
-        for chunk in z:
-            yield chunk
+    # The karaoke fallback maps two stems to the same file
+    files = list(dict.fromkeys(files))
+    stem_dir = os.path.dirname(files[0])
+    await db.close()
+
+    if fmt:
+        # Renditions are cached beside the masters, so only the first export pays for encoding
+        try:
+            files = await asyncio.gather(*(asyncio.to_thread(transcode, path, fmt) for path in files))
+        except TranscodeError as e:
+            raise HTTPException(status_code=500, detail=f"Format conversion failed: {e}")
 
-    response = StreamingResponse(generator(), media_type="application/zip")
-    response.headers["Content-Disposition"] = f"attachment; filename=forge_audio_stems_{job_id}.zip"
-    return response
+    # Stored-mode archive cached per stem set: exact Content-Length, resumable with Range
+    target = archive_path(stem_dir, files)
+    if not os.path.exists(target):
+        await asyncio.to_thread(build_archive, files, target)
 
-@router.get("/{job_id}/{stem_name}")
-async def download_stem(job_id: int, stem_name: str, db: Session = Depends(get_db)):
+    return await file_response(
+        request,
+        target,
+        media_type="application/zip",
+        filename=f"forge_audio_stems_{job_id}.zip"
+    )
+
+@router.api_route("/{job_id}/{stem_name}", methods=["GET", "HEAD"])
+async def download_stem(job_id: int, stem_name: str, request: Request, format: str = None, db: AsyncSession = Depends(get_async_db)):
     from urllib.parse import unquote
     # Handle both URL encoding (e.g., %20) and browser behavior
     stem_name = unquote(stem_name)
     print(f"[DOWNLOAD] Individual stem request for Job {job_id}, Stem: {stem_name}")
+    fmt = _requested_format(format)
     
-    job = db.query(Job).filter(Job.id == job_id).first()
+    job = await db.get(Job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Stems for this job have expired")
     if not job.stems:
         raise HTTPException(status_code=404, detail="Stems not generated yet")
 
@@ -67,16 +95,22 @@ async def download_stem(job_id: int, stem_name: str, db: Session = Depends(get_d
         raise HTTPException(status_code=404, detail="Stem not found")
     
     stem_path = job.stems[stem_name]
-    filename = os.path.basename(stem_path)
     
-    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    file_path = os.path.join(base_dir, "stems", str(job_id), filename)
+    # Cache hits point at another job's directory, so resolve from the stored URL
+    file_path = await localize_stem(stem_path)
     
-    if not os.path.exists(file_path):
+    if not file_path:
         raise HTTPException(status_code=404, detail="File on disk not found")
+    await db.close()
+
+    if fmt:
+        try:
+            file_path = await asyncio.to_thread(transcode, file_path, fmt)
+        except TranscodeError as e:
+            raise HTTPException(status_code=500, detail=f"Format conversion failed: {e}")
         
-    return FileResponse(
-        path=file_path,
-        filename=f"{job.filename.split('.')[0]}_{stem_name.replace(' ', '_')}{os.path.splitext(filename)[1]}",
-        media_type="audio/wav"
+    return await file_response(
+        request,
+        file_path,
+        filename=f"{job.filename.split('.')[0]}_{stem_name.replace(' ', '_')}{os.path.splitext(file_path)[1]}"
     )
@@ -1,37 +1,176 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import asyncio
+import hashlib
+import json
 import os
-from ..database import get_db
+from typing import List, Optional
+from ..database import get_async_db, AsyncSessionLocal
 from ..models.job import Job
-from ..services.chord_service import chord_service
+from ..services.chord_service import chord_service, CHORD_VOCABULARIES
+from ..services.analysis_store import analysis_store, make_params_key
+from ..services.analysis_engine import analysis_engine, ANALYSIS_KINDS, MELODIC_STEMS
+from ..services.analysis_executor import analysis_executor, AnalysisTimeout
+from ..services.job_events import job_events, job_snapshot, TERMINAL_STATUSES
+from ..services.status_cache import job_status_cache
+from ..services.scheduler import queue_position
+from ..utils.http_files import etag_matches
+from ..services.previews import render_previews, preview_urls, PEAK_LEVELS
+from .stems import resolve_stem_path, localize_stem
 
 router = APIRouter(prefix="/api/jobs", tags=["jobs"])
 
-@router.get("/{job_id}")
-async def get_job_status(job_id: int, db: Session = Depends(get_db)):
-    job = db.query(Job).filter(Job.id == job_id).first()
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-        
+KEEPALIVE_SECONDS = 15
+MAX_BATCH_IDS = 200
+MAX_BATCH_ANALYSES = 50
+
+@router.get("/")
+async def get_jobs_status(ids: str, db: AsyncSession = Depends(get_async_db)):
+    """Batch status: `?ids=1,2,3`. Cached snapshots are used as-is; the rest come from one IN query."""
+    try:
+        job_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of job IDs")
+    if len(job_ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many job IDs. Maximum is {MAX_BATCH_IDS}")
+
+    snapshots = await job_status_cache.aget_many(job_ids)
+
+    uncached = [job_id for job_id in job_ids if job_id not in snapshots]
+    if uncached:
+        for job in await db.scalars(select(Job).where(Job.id.in_(uncached))):
+            snapshots[job.id] = job_snapshot(job)
+            await job_status_cache.aput(snapshots[job.id])
+
     return {
-        "id": job.id,
-        "filename": job.filename,
-        "status": job.status,
-        "progress": job.progress,
-        "stems": job.stems,
-        "error": job.error_message
+        "jobs": [snapshots[job_id] for job_id in job_ids if job_id in snapshots],
+        "missing": [job_id for job_id in job_ids if job_id not in snapshots]
     }
 
-@router.post("/{job_id}/detect-chords")
-async def detect_chords(job_id: int, stem: str = None, db: Session = Depends(get_db)):
-    print(f"[API] Triggering chord detection for job {job_id}, target stem: {stem or 'default'}")
-    job = db.query(Job).filter(Job.id == job_id).first()
+def _snapshot_etag(snapshot):
+    return f'"{hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()[:20]}"'
+
+@router.get("/{job_id}")
+async def get_job_status(job_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Polled constantly: serve from the status cache, which job events keep current
+    snapshot = await job_status_cache.aget(job_id)
+    if snapshot is None:
+        job = await db.get(Job, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        snapshot = job_snapshot(job)
+        await job_status_cache.aput(snapshot)
+
+    # Waiting jobs move up the queue without any event, so position is computed per poll
+    if snapshot["status"] == "pending":
+        snapshot = {**snapshot, "queue_position": await queue_position(db, job_id)}
+
+    # Clients must revalidate, but an unchanged poll costs a 304 with no body
+    headers = {"ETag": _snapshot_etag(snapshot), "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=snapshot, headers=headers)
+
+async def _job_updates(job_id: int, db: AsyncSession):
+    """
+    Yields the current job snapshot, then every published transition until the
+    job reaches a terminal state. None is yielded when the stream goes idle.
+    """
+    # Subscribe before reading so no transition can slip between the two
+    sub = job_events.subscribe(job_id)
+    try:
+        job = await db.get(Job, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        snapshot = job_snapshot(job)
+        # Don't hold a pooled connection for the life of the stream
+        await db.close()
+        yield snapshot
+
+        while snapshot["status"] not in TERMINAL_STATUSES:
+            try:
+                snapshot = await asyncio.wait_for(sub.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            yield snapshot
+    finally:
+        sub.close()
+
+@router.get("/{job_id}/events")
+async def stream_job_events(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    updates = _job_updates(job_id, db)
+    # Pull the first snapshot eagerly so a missing job is a plain 404
+    first = await updates.__anext__()
+
+    async def event_stream():
+        try:
+            yield f"event: status\ndata: {json.dumps(first)}\n\n"
+            async for snapshot in updates:
+                if snapshot is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+        finally:
+            await updates.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/{job_id}/ws")
+async def job_events_socket(websocket: WebSocket, job_id: int, db: AsyncSession = Depends(get_async_db)):
+    await websocket.accept()
+    updates = _job_updates(job_id, db)
+    try:
+        async for snapshot in updates:
+            if snapshot is not None:
+                await websocket.send_json(snapshot)
+        await websocket.close()
+    except HTTPException as he:
+        await websocket.close(code=4404, reason=he.detail)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await updates.aclose()
+
+def _previews_missing(urls):
+    for url in (urls["preview"], urls["peaks"][str(PEAK_LEVELS[-1])]):
+        path = resolve_stem_path(url)
+        if not path or not os.path.exists(path):
+            return True
+    return False
+
+@router.get("/{job_id}/previews")
+async def get_stem_previews(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Preview audio and waveform peak URLs (audiowaveform .dat, one per zoom level) for each stem."""
+    job = await db.get(Job, job_id)
     if not job:
-        print(f"[API] Job {job_id} not found")
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    # Chord detection works best on melodic stems (Piano or Other)
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Stems for this job have expired")
+    if job.status != "completed" or not job.stems:
+        raise HTTPException(status_code=409, detail="Stems not generated yet")
+
+    previews = {name: preview_urls(url) for name, url in job.stems.items()}
+
+    # Jobs separated before previews existed get them rendered on first request
+    missing = [job.stems[name] for name, urls in previews.items() if _previews_missing(urls)]
+    if missing:
+        await db.close()
+        missing = [path for path in [await localize_stem(url) for url in missing] if path]
+        await asyncio.to_thread(render_previews, missing)
+
+    return {"job_id": job_id, "peak_levels": PEAK_LEVELS, "stems": previews}
+
+async def _analysis_stem(job: Job, stem: str = None):
+    """(stem name, local path) to analyse: `stem` if given (loosely matched), else the default melodic stem."""
     stem_path = None
     melodic_key = None
     
@@ -42,23 +181,18 @@ async def detect_chords(job_id: int, stem: str = None, db: Session = Depends(get
             for key in job.stems.keys():
                 if stem.lower() in key.lower():
                     melodic_key = key
-                    path = job.stems.get(key)
-                    # Construct absolute path
-                    import tempfile
-                    base_temp_dir = os.path.join(tempfile.gettempdir(), "forge_audio")
-                    stem_path = os.path.join(base_temp_dir, path.lstrip('/'))
+                    # Cache hits point at another job's directory, so resolve from the stored URL
+                    stem_path = await localize_stem(job.stems.get(key)) or resolve_stem_path(job.stems.get(key))
                     print(f"[API] Targeted specific stem: {key} at {stem_path}")
                     break
         
         # Fallback to default melodic stems if no specific stem found/requested
         if not stem_path:
-            for key in ["Piano", "Other Instruments", "Other"]:
+            for key in MELODIC_STEMS:
                 path = job.stems.get(key)
                 if path:
                     melodic_key = key
-                    import tempfile
-                    base_temp_dir = os.path.join(tempfile.gettempdir(), "forge_audio")
-                    stem_path = os.path.join(base_temp_dir, path.lstrip('/'))
+                    stem_path = await localize_stem(path) or resolve_stem_path(path)
                     print(f"[API] Found default melodic stem: {key} at {stem_path}")
                     break
 
@@ -69,16 +203,218 @@ async def detect_chords(job_id: int, stem: str = None, db: Session = Depends(get
     if not os.path.exists(stem_path):
         print(f"[API] Physical file not found at path: {stem_path}")
         raise HTTPException(status_code=400, detail=f"File not found on disk. Tried: {stem_path}")
+    return melodic_key, stem_path
+
+def _check_chord_options(vocabulary, switch_penalty):
+    if vocabulary not in CHORD_VOCABULARIES:
+        raise HTTPException(status_code=400, detail=f"Unknown chord vocabulary. Available: {', '.join(CHORD_VOCABULARIES)}")
+    if switch_penalty is not None and switch_penalty < 0:
+        raise HTTPException(status_code=400, detail="switch_penalty must be non-negative")
+
+@router.post("/{job_id}/detect-chords")
+async def detect_chords(
+    job_id: int,
+    stem: str = None,
+    vocabulary: str = "majmin",
+    beat_sync: bool = False,
+    switch_penalty: float = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    print(f"[API] Triggering chord detection for job {job_id}, target stem: {stem or 'default'}")
+    job = await db.get(Job, job_id)
+    if not job:
+        print(f"[API] Job {job_id} not found")
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    _check_chord_options(vocabulary, switch_penalty)
+
+    # Chord detection works best on melodic stems (Piano or Other)
+    melodic_key, stem_path = await _analysis_stem(job, stem)
 
     try:
         print(f"[API] Starting analysis on {melodic_key}...")
-        # Run blocking chord detection in a separate thread to keep event loop free
-        chords = await asyncio.to_thread(chord_service.detect_chords, stem_path)
+        # Chord detection runs in the analysis process pool to keep the event loop and threads free;
+        # results are persisted per job/stem/parameters and identical requests share one run
+        async def compute():
+            results = await analysis_executor.run(stem_path, ["chords"], vocabulary, switch_penalty, beat_sync)
+            return results["chords"]
+
+        chords, cached = await analysis_store.get_or_compute(
+            db, job_id, melodic_key, "chords", chord_service.analysis_params(vocabulary, switch_penalty, beat_sync), compute
+        )
         
-        # job.chords = chords # Column does not exist in production
-        # db.commit()
-        print(f"[API] Analysis successful. {len(chords)} chords saved (in-memory only).")
-        return {"status": "success", "chords": chords, "analyzed_stem": melodic_key}
+        print(f"[API] Analysis successful. {len(chords)} chords ({'stored' if cached else 'computed'}).")
+        return {"status": "success", "chords": chords, "analyzed_stem": melodic_key, "cached": cached}
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"[API] Analysis failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chord detection failed: {str(e)}")
+
+@router.get("/{job_id}/analysis")
+async def get_stem_analysis(
+    job_id: int,
+    stem: str = None,
+    kinds: str = "chords,beats,key",
+    vocabulary: str = "majmin",
+    beat_sync: bool = False,
+    switch_penalty: float = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Chords, tempo/beat grid and key for one stem. Usually precomputed after separation; anything missing is computed in one pass."""
+    requested = list(dict.fromkeys(k.strip() for k in kinds.split(",") if k.strip()))
+    unknown = [k for k in requested if k not in ANALYSIS_KINDS]
+    if not requested or unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown analysis kind. Available: {', '.join(ANALYSIS_KINDS)}")
+    _check_chord_options(vocabulary, switch_penalty)
+
+    job = await db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Stems for this job have expired")
+    stem_name, stem_path = await _analysis_stem(job, stem)
+
+    try:
+        results, cached = await analysis_store.get_or_compute_many(
+            db, job_id, stem_name,
+            {kind: analysis_engine.analysis_params(kind, vocabulary, switch_penalty, beat_sync) for kind in requested},
+            lambda missing: analysis_executor.run(stem_path, missing, vocabulary, switch_penalty, beat_sync)
+        )
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        print(f"[API] Analysis failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    return {"job_id": job_id, "analyzed_stem": stem_name, "results": results, "cached": cached}
+
+class AnalysisBatchItem(BaseModel):
+    job_id: int
+    stem: Optional[str] = None
+    kinds: List[str] = list(ANALYSIS_KINDS)
+
+class AnalysisBatchRequest(BaseModel):
+    items: List[AnalysisBatchItem]
+    vocabulary: str = "majmin"
+    beat_sync: bool = False
+    switch_penalty: Optional[float] = None
+
+@router.post("/analysis")
+async def analyze_batch(body: AnalysisBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Analyse several stems, of one job or many, in one request. Items run
+    concurrently in the analysis pool; each reports its own results or error.
+    """
+    if len(body.items) > MAX_BATCH_ANALYSES:
+        raise HTTPException(status_code=400, detail=f"Too many items. Maximum is {MAX_BATCH_ANALYSES}")
+    if any(kind not in ANALYSIS_KINDS for item in body.items for kind in item.kinds):
+        raise HTTPException(status_code=400, detail=f"Unknown analysis kind. Available: {', '.join(ANALYSIS_KINDS)}")
+    _check_chord_options(body.vocabulary, body.switch_penalty)
+
+    job_ids = {item.job_id for item in body.items}
+    jobs = {job.id: job for job in (await db.scalars(select(Job).where(Job.id.in_(job_ids)))).all()}
+    # Items use their own sessions so they can run concurrently
+    await db.close()
+
+    async def analyze(item):
+        entry = {"job_id": item.job_id, "stem": item.stem}
+        job = jobs.get(item.job_id)
+        if not job:
+            return {**entry, "error": "Job not found"}
+        if job.status == "expired":
+            return {**entry, "error": "Stems for this job have expired"}
+        try:
+            stem_name, stem_path = await _analysis_stem(job, item.stem)
+        except HTTPException as e:
+            return {**entry, "error": e.detail}
+        entry["stem"] = stem_name
+        kinds = list(dict.fromkeys(item.kinds))
+        try:
+            async with AsyncSessionLocal() as session:
+                results, cached = await analysis_store.get_or_compute_many(
+                    session, job.id, stem_name,
+                    {kind: analysis_engine.analysis_params(kind, body.vocabulary, body.switch_penalty, body.beat_sync) for kind in kinds},
+                    lambda missing: analysis_executor.run(stem_path, missing, body.vocabulary, body.switch_penalty, body.beat_sync)
+                )
+        except AnalysisTimeout as e:
+            return {**entry, "error": str(e)}
+        except Exception as e:
+            print(f"[API] Batch analysis failed for job {job.id} {stem_name}: {str(e)}")
+            return {**entry, "error": f"Analysis failed: {str(e)}"}
+        return {**entry, "results": results, "cached": cached}
+
+    return {"results": await asyncio.gather(*(analyze(item) for item in body.items))}
+
+@router.get("/{job_id}/chords/stream")
+async def stream_chords(
+    job_id: int,
+    stem: str = None,
+    vocabulary: str = "majmin",
+    switch_penalty: float = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Server-sent chord segments as soon as each is decided, for long stems where
+    waiting for the whole analysis is slow. Events: `start`, one `chord` per
+    segment, then `done` (or `error`). Finished results are stored and replayed.
+    """
+    _check_chord_options(vocabulary, switch_penalty)
+    job = await db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Stems for this job have expired")
+    stem_name, stem_path = await _analysis_stem(job, stem)
+
+    # Streaming uses per-block chroma, so its results are stored apart from detect-chords'
+    params_key = make_params_key({**chord_service.analysis_params(vocabulary, switch_penalty), "streaming": True})
+    stored = await analysis_store.get(db, job_id, stem_name, "chords", params_key)
+    await db.close()
+
+    async def event_stream():
+        yield f"event: start\ndata: {json.dumps({'analyzed_stem': stem_name, 'cached': stored is not None})}\n\n"
+        if stored is not None:
+            for segment in stored:
+                yield f"event: chord\ndata: {json.dumps(segment)}\n\n"
+            yield f"event: done\ndata: {json.dumps({'count': len(stored)})}\n\n"
+            return
+
+        segments = []
+        iterator = chord_service.stream_chords(stem_path, vocabulary, switch_penalty)
+        step = None
+
+        def close_iterator(finished):
+            # A late failure has nobody left to report to; retrieve it so asyncio doesn't log it
+            if not finished.cancelled():
+                finished.exception()
+            iterator.close()
+
+        try:
+            while True:
+                # Shielded: a disconnect must not mark the step done while its thread still runs the generator
+                step = asyncio.ensure_future(asyncio.to_thread(next, iterator, None))
+                segment = await asyncio.shield(step)
+                if segment is None:
+                    break
+                segments.append(segment)
+                yield f"event: chord\ndata: {json.dumps(segment)}\n\n"
+        except Exception as e:
+            print(f"[API] Streaming chord analysis failed: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        finally:
+            if step is not None and not step.done():
+                # Closing a generator that is still executing raises, so wait for the in-flight step
+                step.add_done_callback(close_iterator)
+            else:
+                iterator.close()
+
+        async with AsyncSessionLocal() as session:
+            await analysis_store.save(session, job_id, stem_name, "chords", params_key, segments)
+        yield f"event: done\ndata: {json.dumps({'count': len(segments)})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
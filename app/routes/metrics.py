@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
+from ..models.job import Job
+from ..services.metrics import metrics, METRICS_ENABLED
+import asyncio
+
+router = APIRouter(tags=["metrics"])
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Read from the jobs table on scrape: it is the queue in worker mode and is kept
+# current in inline mode, so both count every instance's jobs the same way
+QUEUE_DEPTH = metrics.gauge("forge_queue_depth", "Jobs waiting for separation")
+ACTIVE_JOBS = metrics.gauge("forge_active_jobs", "Jobs being separated")
+
+
+@router.get("/metrics")
+async def get_metrics(db: AsyncSession = Depends(get_async_db)):
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    counts = dict((await db.execute(
+        select(Job.status, func.count()).where(Job.status.in_(["pending", "processing"])).group_by(Job.status)
+    )).all())
+    await db.close()
+    QUEUE_DEPTH.set(counts.get("pending", 0))
+    ACTIVE_JOBS.set(counts.get("processing", 0))
+    return PlainTextResponse(await asyncio.to_thread(metrics.render), media_type=CONTENT_TYPE)
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Request
+from ..utils.http_files import file_response
+from ..services.storage import storage, STEMS_DIR
+import asyncio
+import os
+
+# Replaces the StaticFiles mount so stem playback gets content ETags,
+# immutable caching and byte ranges for seeking.
+router = APIRouter(prefix="/stems", tags=["stems"])
+
+def resolve_stem_path(stem_url):
+    """Map a stored stem URL (/stems/<dir>/<file>) to its path on disk, or None if it escapes STEMS_DIR."""
+    return storage.resolve(stem_url.removeprefix("/stems/"), STEMS_DIR)
+
+
+async def localize_stem(stem_url):
+    """Local path of a stored stem URL, fetched from the storage backend if needed; None if it doesn't exist."""
+    path = resolve_stem_path(stem_url)
+    if not path or not await asyncio.to_thread(storage.localize, path):
+        return None
+    storage.touch(path)
+    return path
+
+
+@router.api_route("/{stem_dir}/{filename:path}", methods=["GET", "HEAD"])
+async def serve_stem(stem_dir: str, filename: str, request: Request):
+    # filename may include derived/ for transcoded, preview and peak renditions
+    path = await localize_stem(f"{stem_dir}/{filename}")
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return await file_response(request, path)
@@ -1,78 +1,243 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Request, Header
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..database import get_db
+from ..database import get_async_db
 from ..models.job import Job
-from ..services.audio_service import process_audio_job
+from ..models.user import User
+from ..services.audio_service import separation_models
+from ..services import job_queue
+from ..services.scheduler import job_scheduler, check_admission, QueueFull, MAX_QUEUED_JOBS, MAX_QUEUED_PER_USER
+from ..services.stem_cache import stem_cache, make_key
+from ..services.storage import storage, StorageFull, UPLOADS_DIR, PARTIAL_DIR
+from ..services.lifecycle import lifecycle_collector
+from ..services.metrics import metrics
+import aiofiles
+import asyncio
+import hashlib
+import json
 import os
-import shutil
 import uuid
+from typing import List, Optional
 
 router = APIRouter(prefix="/api/upload", tags=["upload"])
 
-import tempfile
-BASE_TEMP_DIR = os.path.join(tempfile.gettempdir(), "forge_audio")
-UPLOAD_DIR = os.path.join(BASE_TEMP_DIR, "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+storage.ensure_layout()
 
 ALLOWED_EXTENSIONS = {".mp3", ".wav", ".ogg", ".flac"}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+CHUNK_SIZE = 1024 * 1024
+# A batch the queue could never admit would only ever get 429s, so it is capped by the queue limits
+MAX_BATCH_FILES = min(int(os.getenv("UPLOAD_MAX_BATCH_FILES", "50")), MAX_QUEUED_JOBS, MAX_QUEUED_PER_USER)
+# Room for multipart boundaries and part headers around each file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Whole-body limits for the multipart routes, enforced as the body arrives (see BodySizeLimitMiddleware)
+BODY_LIMITS = {
+    ("POST", "/api/upload/"): MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    ("POST", "/api/upload/batch"): MAX_BATCH_FILES * (MAX_FILE_SIZE + MULTIPART_OVERHEAD),
+}
+
+UPLOAD_WRITE_SECONDS = metrics.histogram("forge_upload_write_seconds", "Time to stream one upload body (or session chunk) to disk")
+UPLOAD_BYTES = metrics.counter("forge_upload_bytes_total", "Upload bytes written to disk")
+
+# Resumable sessions continued in this process keep their running hash: upload_id -> (offset, hasher)
+_session_hashers = {}
+_session_locks = {}
+
+
+def _forget_session(upload_id):
+    _session_hashers.pop(upload_id, None)
+    _session_locks.pop(upload_id, None)
+
+
+# Abandoned sessions are collected by lifecycle GC; their in-memory state goes with them
+lifecycle_collector.on_session_removed(_forget_session)
+
+
+def _check_extension(filename):
+    file_ext = os.path.splitext(filename or "")[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    return file_ext
+
+
+def _too_large():
+    return HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024 * 1024)}MB")
+
+
+async def _upload_file_chunks(file: UploadFile):
+    while chunk := await file.read(CHUNK_SIZE):
+        yield chunk
+
+
+async def _stream_to_disk(chunks, path, hasher, offset=0, limit=None):
+    """
+    Append `chunks` to `path` without blocking the event loop. Returns the new size.
+    Whatever reaches the disk counts toward the quota, even if the stream fails;
+    callers discarding the file go through storage so the usage goes back down.
+    """
+    limit = limit or MAX_FILE_SIZE
+    written = 0
+    try:
+        with UPLOAD_WRITE_SECONDS.time():
+            async with aiofiles.open(path, "ab" if offset else "wb") as out:
+                async for chunk in chunks:
+                    if offset + written + len(chunk) > limit:
+                        raise _too_large()
+                    await out.write(chunk)
+                    hasher.update(chunk)
+                    written += len(chunk)
+    finally:
+        storage.add_usage(written)
+    UPLOAD_BYTES.inc(written)
+    return offset + written
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher
+
+
+def _add_job(db: Session, filename, save_path, audio_hash, high_quality, user_id=None):
+    """Add a Job row for a stored upload, completing it from cache when possible. Returns (job, cached); the caller commits."""
+    job = Job(
+        filename=filename,
+        status="pending",
+        input_path=save_path,
+        high_quality=high_quality,
+        audio_hash=audio_hash,
+        user_id=user_id
+    )
+    db.add(job)
+    db.flush()
+
+    # Same audio already separated with the same models: complete by reference
+    cache_key = make_key(audio_hash, separation_models(high_quality), high_quality)
+    if stem_cache.attach(db, job, cache_key):
+        job.status = "completed"
+        job.progress = 1.0
+        job.input_path = None
+        return job, True
+    return job, False
+
+
+def _create_jobs(db: Session, uploads, user_id=None):
+    """
+    Create Job rows for stored uploads, given as (filename, save_path, audio_hash, high_quality),
+    in one transaction. Returns (results, to_queue) where `to_queue` lists the jobs still
+    needing separation, in upload order, for `_enqueue`.
+    Called through `AsyncSession.run_sync` so it shares the sync stem cache service.
+    """
+    added = [_add_job(db, *upload, user_id=user_id) for upload in uploads]
+    db.commit()
+
+    results = []
+    to_queue = []
+    for (job, cached), (filename, save_path, _, high_quality) in zip(added, uploads):
+        if cached:
+            storage.remove(save_path)
+            print(f"[UPLOAD] Cache hit for job {job.id}")
+            results.append({
+                "job_id": job.id,
+                "message": "Upload successful, stems served from cache.",
+                "filename": filename,
+                "cached": True
+            })
+            continue
+
+        to_queue.append((job.id, save_path, high_quality))
+        results.append({
+            "job_id": job.id,
+            "message": "Upload successful, separation task queued.",
+            "filename": filename
+        })
+    return results, to_queue
+
+
+def _enqueue(to_queue, user_id=None):
+    # In worker mode the pending rows are the queue; otherwise the scheduler runs them in this process
+    if job_queue.EXECUTION_MODE == "inline":
+        for job_id, save_path, high_quality in to_queue:
+            job_scheduler.submit(job_id, save_path, high_quality, user_id)
+
+
+async def _create_and_enqueue(db: AsyncSession, uploads, user_id=None):
+    # Inputs reach the storage backend before any worker can claim their jobs
+    await asyncio.gather(*(asyncio.to_thread(storage.publish, upload[1]) for upload in uploads))
+    results, to_queue = await db.run_sync(_create_jobs, uploads, user_id)
+    _enqueue(to_queue, user_id)
+    return results
+
+
+async def _admit(db: AsyncSession, count, user_id, incoming=0):
+    """
+    Back-pressure: 429 with Retry-After when the separation queue can't take `count`
+    more jobs, 507 when storing `incoming` more bytes would exceed the disk quota.
+    """
+    if user_id is not None and not await db.get(User, user_id):
+        raise HTTPException(status_code=400, detail="Unknown user")
+    try:
+        await check_admission(db, count, user_id)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    try:
+        await asyncio.to_thread(storage.check_quota, incoming)
+    except StorageFull as e:
+        lifecycle_collector.request_collection()
+        raise HTTPException(status_code=507, detail=str(e), headers={"Retry-After": "60"})
+
+
+def _declared_length(request: Request):
+    declared = request.headers.get("content-length")
+    return int(declared) if declared and declared.isdigit() else 0
+
 
 @router.post("/")
 async def upload_audio(
-    background_tasks: BackgroundTasks,
+    request: Request,
     file: UploadFile = File(...),
     high_quality: bool = False,
-    db: Session = Depends(get_db)
+    user_id: Optional[int] = Header(None, alias="X-User-Id"),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    save_path = None
     try:
         import time
         start = time.time()
         print(f"[UPLOAD] Started at {start}")
-        
+
         # Validate file extension
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        print(f"[UPLOAD] File extension check: {time.time() - start:.2f}s")
-        
-        if file_ext not in ALLOWED_EXTENSIONS:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
-            )
+        file_ext = _check_extension(file.filename)
+
+        # The body is already spooled (its total size was capped by BodySizeLimitMiddleware);
+        # refuse before storing it if the queue or the disk can't take the job
+        await _admit(db, 1, user_id, _declared_length(request))
 
         # Create unique filename
         file_id = str(uuid.uuid4())
-        save_path = os.path.join(UPLOAD_DIR, f"{file_id}{file_ext}")
-        print(f"[UPLOAD] Path created: {time.time() - start:.2f}s")
-        
+        save_path = storage.upload_path(f"{file_id}{file_ext}")
+
         # Ensure upload dir exists (extra safety)
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        
-        # Save the file
-        with open(save_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+        # Copy to storage, hashing for the result cache and enforcing the per-file limit
+        hasher = hashlib.sha256()
+        await _stream_to_disk(_upload_file_chunks(file), save_path, hasher)
         print(f"[UPLOAD] File saved: {time.time() - start:.2f}s")
-            
-        # Create database entry
-        job = Job(
-            filename=file.filename,
-            status="pending"
-        )
-        db.add(job)
-        db.commit()
-        db.refresh(job)
-        print(f"[UPLOAD] DB commit: {time.time() - start:.2f}s")
-        
-        # Trigger separation process in background
-        background_tasks.add_task(process_audio_job, job.id, save_path, high_quality)
-        print(f"[UPLOAD] Background task added: {time.time() - start:.2f}s")
-        
-        return {
-            "job_id": job.id,
-            "message": "Upload successful, separation task queued.",
-            "filename": file.filename
-        }
+
+        result = (await _create_and_enqueue(db, [(file.filename, save_path, hasher.hexdigest(), high_quality)], user_id))[0]
+        print(f"[UPLOAD] Job {result['job_id']} created: {time.time() - start:.2f}s")
+        return result
     except HTTPException as he:
+        if save_path:
+            storage.evict_local(save_path)
         raise he
     except Exception as e:
         import traceback
@@ -83,3 +248,164 @@ async def upload_audio(
             content={"error": str(e), "traceback": traceback.format_exc()}
         )
 
+
+@router.post("/batch")
+async def upload_audio_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    high_quality: bool = False,
+    user_id: Optional[int] = Header(None, alias="X-User-Id"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Album-sized uploads: every file is stored, then all jobs are created in one transaction."""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. Maximum is {MAX_BATCH_FILES} per batch")
+    # Validate everything before writing anything
+    extensions = [_check_extension(file.filename) for file in files]
+    await _admit(db, len(files), user_id, _declared_length(request))
+
+    saved = []
+    try:
+        async def store(file, file_ext):
+            save_path = storage.upload_path(f"{uuid.uuid4()}{file_ext}")
+            saved.append(save_path)
+            hasher = hashlib.sha256()
+            await _stream_to_disk(_upload_file_chunks(file), save_path, hasher)
+            return (file.filename, save_path, hasher.hexdigest(), high_quality)
+
+        tasks = [asyncio.create_task(store(file, ext)) for file, ext in zip(files, extensions)]
+        try:
+            uploads = await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other writes before cleaning up, or files they create afterwards are orphaned
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        results = await _create_and_enqueue(db, uploads, user_id)
+    except BaseException:
+        for save_path in saved:
+            storage.evict_local(save_path)
+        raise
+
+    print(f"[UPLOAD] Batch of {len(results)} jobs created: {[r['job_id'] for r in results]}")
+    return {"jobs": results}
+
+
+# Resumable uploads (tus-style): create a session, PATCH chunks at the server's
+# offset, HEAD to discover where to continue after a dropped connection.
+
+def _session_paths(upload_id):
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.json"), os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+
+def _load_session(upload_id):
+    meta_path, part_path = _session_paths(upload_id)
+    if not os.path.exists(meta_path):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return meta, part_path, offset
+
+
+@router.post("/sessions", status_code=201)
+async def create_upload_session(
+    filename: str,
+    length: int,
+    high_quality: bool = False,
+    user_id: Optional[int] = Header(None, alias="X-User-Id"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    _check_extension(filename)
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Upload length must be positive")
+    if length > MAX_FILE_SIZE:
+        raise _too_large()
+    # Admission is decided up front; a session that completes is always accepted
+    await _admit(db, 1, user_id, length)
+
+    upload_id = str(uuid.uuid4())
+    meta_path, part_path = _session_paths(upload_id)
+    async with aiofiles.open(meta_path, "w") as f:
+        await f.write(json.dumps({"filename": filename, "length": length, "high_quality": high_quality, "user_id": user_id}))
+    async with aiofiles.open(part_path, "wb"):
+        pass
+    _session_hashers[upload_id] = (0, hashlib.sha256())
+    print(f"[UPLOAD] Session {upload_id} created for {filename} ({length} bytes)")
+
+    location = f"/api/upload/sessions/{upload_id}"
+    return JSONResponse(
+        status_code=201,
+        content={"upload_id": upload_id, "offset": 0, "length": length, "location": location},
+        headers={"Location": location, "Upload-Offset": "0", "Upload-Length": str(length)}
+    )
+
+
+@router.head("/sessions/{upload_id}")
+async def get_upload_offset(upload_id: str):
+    meta, _, offset = _load_session(upload_id)
+    return Response(
+        status_code=200,
+        headers={"Upload-Offset": str(offset), "Upload-Length": str(meta["length"]), "Cache-Control": "no-store"}
+    )
+
+
+@router.patch("/sessions/{upload_id}")
+async def append_upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    lock = _session_locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        meta, part_path, offset = _load_session(upload_id)
+        if upload_offset != offset:
+            raise HTTPException(status_code=409, detail=f"Offset mismatch, server is at {offset}", headers={"Upload-Offset": str(offset)})
+
+        # The running hash is only valid if this process saw every byte so far
+        tracked = _session_hashers.pop(upload_id, None)
+        hash_tracked = tracked is not None and tracked[0] == offset
+        hasher = tracked[1] if hash_tracked else hashlib.sha256()
+
+        try:
+            offset = await _stream_to_disk(request.stream(), part_path, hasher, offset=offset, limit=meta["length"])
+        except HTTPException:
+            # Chunk overran the declared length; drop it so the client can retry from the old offset
+            storage.add_usage(upload_offset - os.path.getsize(part_path))
+            with open(part_path, "r+b") as f:
+                f.truncate(upload_offset)
+            raise HTTPException(status_code=413, detail="Chunk exceeds declared upload length")
+        except Exception:
+            # Dropped connection: keep what arrived, the client resumes from HEAD's offset
+            if hash_tracked:
+                _session_hashers[upload_id] = (os.path.getsize(part_path), hasher)
+            raise
+
+        if offset < meta["length"]:
+            if hash_tracked:
+                _session_hashers[upload_id] = (offset, hasher)
+            return JSONResponse(
+                content={"upload_id": upload_id, "offset": offset, "length": meta["length"]},
+                headers={"Upload-Offset": str(offset)}
+            )
+
+        if not hash_tracked:
+            hasher = await asyncio.to_thread(_hash_file, part_path)
+
+        # Upload complete: move into place and create the job
+        file_ext = os.path.splitext(meta["filename"])[1].lower()
+        save_path = storage.upload_path(f"{upload_id}{file_ext}")
+        os.replace(part_path, save_path)
+        os.remove(_session_paths(upload_id)[0])
+        _session_locks.pop(upload_id, None)
+        print(f"[UPLOAD] Session {upload_id} complete ({offset} bytes)")
+
+        upload = (meta["filename"], save_path, hasher.hexdigest(), meta["high_quality"])
+        result = (await _create_and_enqueue(db, [upload], meta.get("user_id")))[0]
+        return JSONResponse(content={**result, "offset": offset}, headers={"Upload-Offset": str(offset)})
@@ -0,0 +1,136 @@
+import os
+import numpy as np
+from ..database import SessionLocal
+from .analysis_store import analysis_store, make_params_key
+from .chord_service import chord_service
+from .features import StemFeatures, ANALYSIS_SR, HOP_LENGTH
+from .metrics import metrics
+
+# Bump when beat or key output changes so persisted results are recomputed
+ENGINE_VERSION = 1
+ANALYSIS_KINDS = ("chords", "beats", "key")
+
+# Run after separation so results exist before anyone asks. Chords and key come
+# from the melodic stem detect-chords defaults to, beats from the drums.
+PIPELINE_ENABLED = os.getenv("ANALYSIS_PIPELINE_ENABLED", "true").lower() in ("1", "true", "yes")
+MELODIC_STEMS = ["Piano", "Other Instruments", "Other"]
+RHYTHM_STEMS = ["Drums"]
+
+ANALYSIS_SECONDS = metrics.histogram(
+    "forge_analysis_seconds", "Time per stem analysis; the first kind of a run also pays for the shared features", ["kind"]
+)
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def _zscore(x, axis=-1):
+    x = x - x.mean(axis=axis, keepdims=True)
+    std = x.std(axis=axis, keepdims=True)
+    return x / np.where(std > 0, std, 1)
+
+
+def _key_profiles():
+    """24 rows (12 major keys, then 12 minor), each a profile rotated to its tonic and z-scored."""
+    rows = [np.roll(MAJOR_PROFILE, tonic) for tonic in range(12)] + [np.roll(MINOR_PROFILE, tonic) for tonic in range(12)]
+    return _zscore(np.vstack(rows))
+
+
+class AnalysisEngine:
+    """
+    Chord, beat/tempo and key analysis of a stem from one set of shared
+    features (see StemFeatures), so asking for several kinds costs one decode.
+    """
+
+    def __init__(self):
+        self.key_profiles = _key_profiles()
+
+    def analysis_params(self, kind, vocabulary="majmin", switch_penalty=None, beat_sync=False):
+        """Parameters that identify a result of `kind` for persistence; the chord options only apply to chords."""
+        if kind == "chords":
+            return chord_service.analysis_params(vocabulary, switch_penalty, beat_sync)
+        params = {"version": ENGINE_VERSION, "sr": ANALYSIS_SR, "hop_length": HOP_LENGTH}
+        if kind == "key":
+            params["profile"] = "krumhansl-kessler"
+        return params
+
+    def beats(self, features):
+        tempo, beat_frames = features.beat_track
+        beat_times = features.frame_times(features.onset_envelope.shape[0])[beat_frames]
+        return {
+            "bpm": round(tempo, 2),
+            "beats": [round(float(t), 3) for t in beat_times],
+        }
+
+    def key(self, features):
+        profile = features.chroma.mean(axis=1)
+        if not profile.any():
+            return {"key": None, "mode": None, "name": None, "confidence": 0.0}
+        correlations = self.key_profiles @ _zscore(profile) / 12
+        order = np.argsort(correlations)[::-1]
+        best = int(order[0])
+        tonic = PITCH_CLASSES[best % 12]
+        mode = "major" if best < 12 else "minor"
+        return {
+            "key": tonic,
+            "mode": mode,
+            "name": f"{tonic} {mode}",
+            "correlation": round(float(correlations[best]), 3),
+            # Margin over the runner-up; relative keys often come close
+            "confidence": round(float(correlations[best] - correlations[order[1]]), 3),
+        }
+
+    def run(self, file_path, kinds, vocabulary="majmin", features=None, switch_penalty=None, beat_sync=False):
+        """Blocking: {kind: result} for each requested kind, computed from shared features."""
+        unknown = set(kinds) - set(ANALYSIS_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown analysis kind(s): {', '.join(sorted(unknown))}. Available: {', '.join(ANALYSIS_KINDS)}")
+        features = features or StemFeatures(file_path)
+        results = {}
+        for kind in kinds:
+            with ANALYSIS_SECONDS.time(kind=kind):
+                if kind == "chords":
+                    results[kind] = chord_service.detect_chords(
+                        file_path, vocabulary, features=features, switch_penalty=switch_penalty, beat_sync=beat_sync
+                    )
+                else:
+                    results[kind] = getattr(self, kind)(features)
+        return results
+
+
+analysis_engine = AnalysisEngine()
+
+
+def _first_stem(stems, candidates):
+    for name in candidates:
+        if stems.get(name):
+            return name
+    return None
+
+
+def pipeline_plan(stems):
+    """{stem name: [kinds]} the post-separation stage computes for a job's stems."""
+    plan = {}
+    melodic = _first_stem(stems, MELODIC_STEMS)
+    if melodic:
+        plan.setdefault(melodic, []).extend(["chords", "key"])
+    rhythm = _first_stem(stems, RHYTHM_STEMS) or melodic
+    if rhythm:
+        plan.setdefault(rhythm, []).append("beats")
+    return plan
+
+
+def save_job_analyses(job_id, results):
+    """Blocking: persist the pipeline stage's {stem: {kind: result}} for a job."""
+    db = SessionLocal()
+    try:
+        for stem, by_kind in results.items():
+            for kind, result in by_kind.items():
+                params_key = make_params_key(analysis_engine.analysis_params(kind))
+                analysis_store.save_sync(db, job_id, stem, kind, params_key, result)
+            print(f"[ANALYSIS] Job {job_id} {stem}: {', '.join(by_kind)} ready")
+    finally:
+        db.close()
@@ -0,0 +1,116 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .analysis_engine import analysis_engine, pipeline_plan, save_job_analyses
+from .metrics import start_snapshot_writer
+
+# Analyses are CPU-bound Python/NumPy work, so they run in their own processes
+# instead of the shared thread pool; throughput then scales with cores.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // 2)
+ANALYSIS_TASK_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_TASK_TIMEOUT_SECONDS", "300"))
+
+
+class AnalysisTimeout(Exception):
+    pass
+
+
+def _run_analysis(file_path, kinds, vocabulary, switch_penalty, beat_sync):
+    # Runs in a pool child; StemFeatures reads the shared on-disk PCM cache
+    return analysis_engine.run(file_path, list(kinds), vocabulary, switch_penalty=switch_penalty, beat_sync=beat_sync)
+
+
+class AnalysisExecutor:
+    """
+    Bounded process pool for stem analyses. Identical requests in flight share
+    one task, at most `workers` tasks are submitted at a time (the rest wait
+    here, so timeouts measure execution, not queueing), and a task that
+    overruns its timeout takes its pool down with it: a running process can't
+    be cancelled any other way. Tasks caught in such a restart are retried once.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, timeout=ANALYSIS_TASK_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        self._slots = None
+        self._slots_loop = None
+        self._inflight = {}
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Long-lived so children keep librosa imported and caches warm between tasks
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=start_snapshot_writer
+            )
+        return self._pool
+
+    def _reset_pool(self, pool):
+        if self._pool is not pool:
+            return  # Already replaced by another task
+        self._pool = None
+        print("[ANALYSIS] Restarting analysis pool")
+        # No public API stops a running task; terminate the children so the pool breaks
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, file_path, kinds, vocabulary="majmin", switch_penalty=None, beat_sync=False):
+        """{kind: result} for `kinds` of `file_path`, computed in the pool."""
+        args = (os.path.realpath(file_path), tuple(kinds), vocabulary, switch_penalty, bool(beat_sync))
+        task = self._inflight.get(args)
+        if task is None:
+            task = asyncio.ensure_future(self._execute(args))
+            self._inflight[args] = task
+            task.add_done_callback(lambda _: self._inflight.pop(args, None))
+        # One caller going away must not cancel the others' shared task
+        return await asyncio.shield(task)
+
+    async def precompute_job(self, job_id, stem_paths):
+        """
+        Post-separation stage: the default analyses of a freshly separated job,
+        computed in the pool and persisted so the first request is a lookup.
+        `stem_paths` maps stem names to files on disk. Failures are logged,
+        never raised into the job.
+        """
+        plan = pipeline_plan(stem_paths)
+        outcomes = await asyncio.gather(*(self.run(stem_paths[stem], kinds) for stem, kinds in plan.items()), return_exceptions=True)
+        results = {}
+        for stem, outcome in zip(plan, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"[ANALYSIS] Job {job_id} {stem} analysis failed: {outcome}")
+            else:
+                results[stem] = outcome
+        try:
+            await asyncio.to_thread(save_job_analyses, job_id, results)
+        except Exception as e:
+            print(f"[ANALYSIS] Job {job_id} saving analyses failed: {e}")
+
+    async def _execute(self, args):
+        # Workers run each job in its own event loop (asyncio.run); the semaphore can't outlive its loop
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.workers)
+            self._slots_loop = loop
+        async with self._slots:
+            for attempt in (1, 2):
+                pool = self._get_pool()
+                try:
+                    return await asyncio.wait_for(asyncio.wrap_future(pool.submit(_run_analysis, *args)), self.timeout)
+                except asyncio.TimeoutError:
+                    self._reset_pool(pool)
+                    raise AnalysisTimeout(f"Analysis timed out after {self.timeout:.0f}s")
+                except BrokenProcessPool:
+                    # Another task's timeout (or a crashed child) restarted the pool under us
+                    self._reset_pool(pool)
+                    if attempt == 2:
+                        raise
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+analysis_executor = AnalysisExecutor()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models.analysis import AnalysisResult
+
+
+def make_params_key(params: dict):
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+def _fail_pending(pending, error):
+    """Settle a shared computation that didn't finish, however the leader exited."""
+    if not isinstance(error, Exception):
+        # The leader was cancelled (client gone); followers get an error instead of hanging
+        error = RuntimeError("Analysis was interrupted before it finished")
+    pending.set_exception(error)
+    # Mark retrieved so an un-awaited failure doesn't log a warning
+    pending.exception()
+
+
+class AnalysisStore:
+    """
+    Persists analysis results per (job, stem, kind, parameters) and coalesces
+    concurrent requests for the same result into a single computation.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def get(self, db: AsyncSession, job_id: int, stem: str, kind: str, params_key: str):
+        return await db.scalar(select(AnalysisResult.result).where(
+            AnalysisResult.job_id == job_id,
+            AnalysisResult.stem == stem,
+            AnalysisResult.kind == kind,
+            AnalysisResult.params_key == params_key,
+        ))
+
+    async def save(self, db: AsyncSession, job_id: int, stem: str, kind: str, params_key: str, result):
+        db.add(AnalysisResult(job_id=job_id, stem=stem, kind=kind, params_key=params_key, result=result))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Another process stored the same result first
+            await db.rollback()
+
+    def save_sync(self, db: Session, job_id: int, stem: str, kind: str, params_key: str, result):
+        """`save` for sync sessions (separation threads and workers)."""
+        db.add(AnalysisResult(job_id=job_id, stem=stem, kind=kind, params_key=params_key, result=result))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+    async def get_or_compute(self, db: AsyncSession, job_id: int, stem: str, kind: str, params: dict, compute):
+        """
+        Returns (result, cached). `compute` is an async callable producing the result
+        when nothing is stored yet; concurrent callers with the same key share one run.
+        """
+        params_key = make_params_key(params)
+        stored = await self.get(db, job_id, stem, kind, params_key)
+        # End the read transaction so no pooled connection is held while computing
+        await db.commit()
+        if stored is not None:
+            return stored, True
+
+        key = (job_id, stem, kind, params_key)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending), True
+
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            result = await compute()
+            await self.save(db, job_id, stem, kind, params_key, result)
+            pending.set_result(result)
+            return result, False
+        except BaseException as e:
+            _fail_pending(pending, e)
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def get_or_compute_many(self, db: AsyncSession, job_id: int, stem: str, requests: dict, compute):
+        """
+        Several kinds for one stem: `requests` maps kind -> params. Returns
+        ({kind: result}, {kind: cached}). `compute(kinds)` is an async callable
+        returning {kind: result} for everything not stored yet, so missing kinds
+        are produced together (sharing features) rather than one run each.
+        """
+        keys = {kind: make_params_key(params) for kind, params in requests.items()}
+        results = {}
+        for kind, params_key in keys.items():
+            stored = await self.get(db, job_id, stem, kind, params_key)
+            if stored is not None:
+                results[kind] = stored
+        await db.commit()
+        cached = {kind: kind in results for kind in keys}
+        missing = [kind for kind in keys if kind not in results]
+        if not missing:
+            return results, cached
+
+        key = (job_id, stem, tuple((kind, keys[kind]) for kind in missing))
+        pending = self._inflight.get(key)
+        if pending is not None:
+            results.update(await asyncio.shield(pending))
+            return results, cached
+
+        pending = asyncio.get_running_loop().create_future()
+        self._inflight[key] = pending
+        try:
+            computed = await compute(missing)
+            for kind in missing:
+                await self.save(db, job_id, stem, kind, keys[kind], computed[kind])
+            pending.set_result(computed)
+        except BaseException as e:
+            _fail_pending(pending, e)
+            raise
+        finally:
+            del self._inflight[key]
+        results.update(computed)
+        return results, cached
+
+
+analysis_store = AnalysisStore()
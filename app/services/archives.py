@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zipstream
+from .metrics import metrics
+from .transcoder import DERIVED_DIRNAME
+
+# Assembled exports are kept beside the stems they contain, keyed by the exact
+# file set, so repeat exports (and Range resumes) are served straight from disk.
+ARCHIVE_DIRNAME = "archives"
+
+ARCHIVE_BUILD_SECONDS = metrics.histogram("forge_zip_export_seconds", "Time to assemble a ZIP export")
+ARCHIVE_THROUGHPUT = metrics.histogram(
+    "forge_zip_export_bytes_per_second", "ZIP export assembly throughput",
+    buckets=[mb * 1024 * 1024 for mb in (5, 10, 25, 50, 100, 250, 500, 1000, 2500)]
+)
+ARCHIVE_BYTES = metrics.counter("forge_zip_export_bytes_total", "Bytes of ZIP exports assembled")
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _drop_lock(path, lock):
+    # Only needed while the archive is being built; later callers find the file
+    with _locks_guard:
+        if _locks.get(path) is lock:
+            del _locks[path]
+
+
+def archive_path(stem_dir, files):
+    """
+    Cache path for a ZIP of `files` under the stem directory they were made from
+    (renditions live one level down, in derived/); changes whenever any member changes.
+    """
+    members = []
+    for path in files:
+        stat = os.stat(path)
+        members.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    key = hashlib.sha256(json.dumps(members).encode()).hexdigest()[:32]
+    return os.path.join(stem_dir, DERIVED_DIRNAME, ARCHIVE_DIRNAME, f"{key}.zip")
+
+
+def build_archive(files, target):
+    """
+    Blocking: write a stored-mode (no deflate) ZIP of `files` to `target` unless it
+    already exists. Audio payloads barely deflate, so storing keeps assembly at disk speed.
+    """
+    with _locks_guard:
+        lock = _locks.setdefault(target, threading.Lock())
+    try:
+        with lock:
+            if os.path.exists(target):
+                return target
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            zs = zipstream.ZipStream(compress_type=zipstream.ZIP_STORED, sized=True)
+            for path in files:
+                zs.add_path(path, arcname=os.path.basename(path))
+            expected = len(zs)
+
+            tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+            start = time.perf_counter()
+            try:
+                with open(tmp_path, "wb") as out:
+                    for chunk in zs:
+                        out.write(chunk)
+                if os.path.getsize(tmp_path) != expected:
+                    raise RuntimeError(f"Archive size mismatch: expected {expected} bytes")
+                os.replace(tmp_path, target)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    finally:
+        _drop_lock(target, lock)
+    elapsed = time.perf_counter() - start
+    ARCHIVE_BUILD_SECONDS.observe(elapsed)
+    ARCHIVE_THROUGHPUT.observe(expected / max(elapsed, 1e-6))
+    ARCHIVE_BYTES.inc(expected)
+    print(f"[ARCHIVE] Built {os.path.basename(target)} ({expected} bytes, {len(files)} stems)")
+    return target
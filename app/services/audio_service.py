@@ -1,16 +1,78 @@
 import asyncio
 import os
+import time
 import shutil
 import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
 from sqlalchemy.orm import Session
 from ..models.job import Job
 from ..database import SessionLocal
-from audio_separator.separator import Separator
+from .segmenter import separate_file, separate_array, audio_duration
+from .progress import ProgressReporter, stage_timer
+from .previews import render_previews
+from . import pcm_store
+from .storage import storage
+from .analysis_engine import PIPELINE_ENABLED as ANALYSIS_PIPELINE_ENABLED
+from .analysis_executor import analysis_executor
+from .stem_cache import stem_cache, make_key
+from .job_events import job_events, job_snapshot
+from . import job_queue
+from .metrics import metrics
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SEPARATION_MODEL = 'htdemucs_6s.yaml'
+KARAOKE_MODEL = 'UVR_MDXNET_KARA_2.onnx'
+
+def separation_models(high_quality: bool):
+    """Models a job runs, in order; part of the result cache key."""
+    return [SEPARATION_MODEL, KARAOKE_MODEL] if high_quality else [SEPARATION_MODEL]
+
+QUEUE_WAIT_SECONDS = metrics.histogram("forge_queue_wait_seconds", "Time from upload to a job's first separation attempt starting")
+JOB_STAGE_SECONDS = metrics.histogram(
+    "forge_job_stage_seconds", "Wall time of completed jobs per stage (decode, model_load, inference, write, pass2, previews, analysis, total)", ["stage"]
+)
+JOBS_FINISHED = metrics.counter("forge_jobs_finished_total", "Jobs that finished processing, by outcome", ["status"])
+
+def _observe_stages(timings):
+    for stage, seconds in timings.items():
+        # audio_seconds is the input's length, not time spent
+        if stage != "audio_seconds":
+            JOB_STAGE_SECONDS.observe(seconds, stage=stage)
+
+def _observe_queue_wait(job: Job):
+    if not job.created_at or (job.attempts or 0) > 1:
+        return
+    created_at = job.created_at
+    if created_at.tzinfo is None:
+        # SQLite hands back naive UTC timestamps
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    QUEUE_WAIT_SECONDS.observe(max((datetime.now(timezone.utc) - created_at).total_seconds(), 0.0))
+
+# Runs in-memory karaoke passes alongside the demucs pass that feeds them
+_pass2_executor = ThreadPoolExecutor(thread_name_prefix="karaoke-pass")
+
+def _samples_first(source):
+    """Own copy of a stem array as [samples, channels], the layout prepare_mix takes."""
+    source = np.asarray(source, dtype="float32")
+    if source.ndim == 2 and source.shape[0] <= 2 < source.shape[1]:
+        source = source.T
+    return np.array(source, copy=True)
+
+def _karaoke_pass(output_dir, mix, label_path, progress, timings):
+    # Own stage timings would interleave with pass 1's, so only the pass total is recorded
+    with stage_timer(timings, "pass2"):
+        return separate_array(KARAOKE_MODEL, output_dir, mix, label_path, progress)
+
+def _commit(db: Session, job: Job):
+    """Commit a job transition and push it to event stream subscribers."""
+    db.commit()
+    job_events.publish(job_snapshot(job))
+
 async def process_audio_job(job_id: int, file_path: str = None, high_quality: bool = False):
     db = SessionLocal()
     job = None
@@ -21,45 +83,73 @@ async def process_audio_job(job_id: int, file_path: str = None, high_quality: bo
             print(f"[JOB] Job {job_id} not found in database!")
             return
 
+        # A duplicate of this audio may have finished while we were queued
+        cache_key = make_key(job.audio_hash, separation_models(high_quality), high_quality) if job.audio_hash else None
+        if cache_key and stem_cache.attach(db, job, cache_key):
+            job.status = "completed"
+            job.progress = 1.0
+            _commit(db, job)
+            print(f"[JOB] Job {job_id} completed from cache")
+            return
+
+        _observe_queue_wait(job)
         job.status = "processing"
         job.progress = 0.1
-        db.commit()
+        _commit(db, job)
+        timings = {}
+        job_start = time.perf_counter()
 
-        # Create output directory for this job (absolute path to be safe)
-        import tempfile
-        base_dir = os.path.join(tempfile.gettempdir(), "forge_audio")
-        output_dir = os.path.join(base_dir, "stems", str(job_id))
+        # Create output directory for this job
+        output_dir = storage.job_dir(job_id)
         os.makedirs(output_dir, exist_ok=True)
 
-        if file_path and os.path.exists(file_path):
-            # Initialize Separator
+        # With a remote storage backend the upload may have landed on another instance
+        if file_path and await asyncio.to_thread(storage.localize, file_path):
             # We use htdemucs_6s for 6-stem separation as requested.
-            # To avoid OOM on standard cloud instances, we must be memory efficient.
-            separator = Separator(output_dir=output_dir)
-            
-            # Update progress
+            # Separators come from the process-wide pool so back-to-back jobs skip the model load;
+            # long tracks are separated in overlapping windows to keep memory flat.
             job.progress = 0.2
-            db.commit()
-            
-            print(f"[JOB] Separating job {job_id} using htdemucs_6s...")
-            # Run the blocking separation in a thread pool
+            _commit(db, job)
             loop = asyncio.get_event_loop()
+
+            # Ingestion: decode once into shared PCM that separation (and later analysis) memory-maps
+            with stage_timer(timings, "decode"):
+                await loop.run_in_executor(None, pcm_store.ensure, file_path)
+            timings["audio_seconds"] = round(audio_duration(file_path), 2)
             
-            # Load 6-stem model
-            separator.load_model('htdemucs_6s.yaml')
-            
-            # Run separation
-            # separate() might not accept 'shifts' directly depending on version, 
-            # but usually defaults are acceptable if we clean up aggressively.
-            output_files = await loop.run_in_executor(None, separator.separate, file_path)
+            # Separation threads report fine-grained progress; the reporter batches the writes
+            reporter = ProgressReporter(job_id, initial=0.2)
+            pass1_end = 0.6 if high_quality else 0.9
             
-            # Aggressive Memory Cleanup
-            del separator
-            import gc
-            gc.collect()
+            # Pipeline mode for high quality: demucs hands its vocals to the karaoke model
+            # in memory as soon as they exist, and pass 2 runs while the remaining stems are
+            # written. Segmented runs never call on_stem and use the file-based pass 2 below.
+            pass2 = None
+            on_stem = None
+            if high_quality:
+                def on_stem(stem_name, source):
+                    nonlocal pass2
+                    if stem_name.lower() == "vocals" and pass2 is None:
+                        print(f"[JOB] Job {job_id} Pass 2 (Karaoke) - Splitting vocals in memory (High Quality)...")
+                        pass2 = _pass2_executor.submit(
+                            _karaoke_pass, output_dir, _samples_first(source), file_path, reporter.stage(pass1_end, 0.95), timings
+                        )
+
+            print(f"[JOB] Separating job {job_id} using htdemucs_6s...")
+            # Run the blocking separation in a thread pool
+            try:
+                output_files = await loop.run_in_executor(
+                    None, separate_file, SEPARATION_MODEL, output_dir, file_path, reporter.stage(0.2, pass1_end), timings, on_stem
+                )
+            except BaseException:
+                # Pass 2 may already be writing into output_dir: let it settle before
+                # the failure is handled, and don't leave its outcome unretrieved
+                if pass2 is not None and not pass2.cancel():
+                    await asyncio.gather(asyncio.wrap_future(pass2), return_exceptions=True)
+                raise
             
-            job.progress = 0.6
-            db.commit()
+            job.progress = pass1_end
+            _commit(db, job)
             
             # audio-separator returns list of filenames in output_dir
             stems_result = {}
@@ -83,29 +173,24 @@ async def process_audio_job(job_id: int, file_path: str = None, high_quality: bo
                     stems_result['Other_Signal'] = f"/stems/{job_id}/{filename}"
             
             # Pass 2: Split Vocals into Lead and Backing Vocals if we have a vocals track
-            if high_quality and vocals_filename:
+            output_files_kara = []
+            if pass2 is not None:
+                output_files_kara = await asyncio.wrap_future(pass2)
+            elif high_quality and vocals_filename:
                 print(f"[JOB] Job {job_id} Pass 2 (Karaoke) - Splitting vocals (High Quality)...")
                 vocals_full_path = os.path.join(output_dir, vocals_filename)
                 
-                # Re-init separator for second pass (clean slate)
-                separator_kv = Separator(output_dir=output_dir)
-                separator_kv.load_model('UVR_MDXNET_KARA_2.onnx')
-                
-                job.progress = 0.85
-                db.commit()
-                
-                output_files_kara = await loop.run_in_executor(None, separator_kv.separate, vocals_full_path)
+                with stage_timer(timings, "pass2"):
+                    output_files_kara = await loop.run_in_executor(
+                        None, separate_file, KARAOKE_MODEL, output_dir, vocals_full_path, reporter.stage(pass1_end, 0.95)
+                    )
                 
-                # Cleanup usage
-                del separator_kv
-                gc.collect()
-                
-                for filename in output_files_kara:
-                    fn_lower = filename.lower()
-                    if '_(vocals)_uvr_mdxnet_kara_2' in fn_lower:
-                        stems_result['Lead Vocals'] = f"/stems/{job_id}/{filename}"
-                    elif '_(instrumental)_uvr_mdxnet_kara_2' in fn_lower:
-                        stems_result['Backing Vocals'] = f"/stems/{job_id}/{filename}"
+            for filename in output_files_kara:
+                fn_lower = filename.lower()
+                if '_(vocals)_uvr_mdxnet_kara_2' in fn_lower:
+                    stems_result['Lead Vocals'] = f"/stems/{job_id}/{filename}"
+                elif '_(instrumental)_uvr_mdxnet_kara_2' in fn_lower:
+                    stems_result['Backing Vocals'] = f"/stems/{job_id}/{filename}"
 
             # Final assembly and safety checks
             # If Pass 2 (Vocal splitting) failed, fall back to base Vocals
@@ -125,35 +210,69 @@ async def process_audio_job(job_id: int, file_path: str = None, high_quality: bo
             
             # Filter out None values
             job.stems = {k: v for k, v in final_stems.items() if v}
+
+            # Post-separation: preview renditions and waveform peaks so the dashboard
+            # can draw and play every stem without fetching the masters
+            job.progress = 0.95
+            _commit(db, job)
+            with stage_timer(timings, "previews"):
+                await loop.run_in_executor(
+                    None, render_previews, [os.path.join(output_dir, os.path.basename(url)) for url in job.stems.values()]
+                )
         else:
-            job.status = "failed"
-            job.error_message = "Input file not found"
+            # Handled below like any other failure: the backend may come back on a retry
+            raise FileNotFoundError("Input file not found")
 
+        timings["total"] = round(time.perf_counter() - job_start, 3)
+        job.timings = timings
         job.status = "completed"
         job.progress = 1.0
-        db.commit()
-        print(f"[JOB] Job {job_id} completed successfully!")
+        _commit(db, job)
+        JOBS_FINISHED.inc(status="completed")
+        _observe_stages(timings)
+        print(f"[JOB] Job {job_id} completed successfully! Timings: {timings}")
+
+        if job.stems:
+            try:
+                await asyncio.to_thread(storage.publish_dir, output_dir)
+            except Exception as publish_err:
+                print(f"[JOB] Failed to publish stems for job {job_id}: {publish_err}")
+
+        if cache_key and job.stems:
+            try:
+                stem_cache.store(db, job, cache_key, output_dir)
+            except Exception as cache_err:
+                db.rollback()
+                print(f"[JOB] Failed to cache stems for job {job_id}: {cache_err}")
+
+        # Analysis stage: the job is already usable; chords, key and beats are
+        # persisted behind it so the dashboard's first request is a lookup
+        if job.stems and ANALYSIS_PIPELINE_ENABLED:
+            stem_paths = {name: os.path.join(output_dir, os.path.basename(url)) for name, url in job.stems.items()}
+            analysis_timings = {}
+            try:
+                with stage_timer(analysis_timings, "analysis"):
+                    await analysis_executor.precompute_job(job_id, stem_paths)
+                job.timings = {**timings, **analysis_timings}
+                db.commit()
+                _observe_stages(analysis_timings)
+            except Exception as analysis_err:
+                db.rollback()
+                print(f"[JOB] Analysis stage failed for job {job_id}: {analysis_err}")
 
     except Exception as e:
         error_msg = f"Error during separation: {str(e)}"
         print(f"[JOB] Background task error for job {job_id}: {error_msg}")
+        retrying = False
         if job:
             try:
-                job.status = "failed"
-                job.error_message = error_msg
-                db.commit()
+                # Retry or fail is settled before anything is published
+                retrying = job_queue.fail_attempt(job, error_msg)
+                _commit(db, job)
             except Exception as db_err:
                 print(f"[JOB] Failed to update job status to error: {db_err}")
+        # A re-queued attempt isn't an outcome yet; the job is counted when it finally settles
+        if not retrying:
+            JOBS_FINISHED.inc(status="failed")
     finally:
-        # Final safety cleanup
-        try:
-            if 'separator' in locals(): del separator
-            if 'separator_kv' in locals(): del separator_kv
-            import gc
-            gc.collect()
-        except:
-            pass
         db.close()
-
-
-
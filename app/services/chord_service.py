@@ -7,87 +7,234 @@ import librosa
 import numpy as np
 import os
 import logging
+import soundfile as sf
+from .features import StemFeatures, ANALYSIS_SR, HOP_LENGTH
 
 logger = logging.getLogger(__name__)
 
+# Bump when detection output changes so persisted results are recomputed
+ANALYSIS_VERSION = 2
+
+# Viterbi smoothing: log-likelihood a chord change has to overcome, in units of
+# frame evidence. Higher means fewer, longer segments.
+DEFAULT_SWITCH_PENALTY = float(os.getenv("CHORD_SWITCH_PENALTY", "8.0"))
+# Sharpness of the softmax turning template similarities into per-frame chord probabilities
+EMISSION_SCALE = 10.0
+
+# Streaming mode: audio read per block, and the most decoding may lag behind it
+# before a segment is committed even though competing paths haven't merged yet
+STREAM_BLOCK_SECONDS = float(os.getenv("CHORD_STREAM_BLOCK_SECONDS", "10"))
+STREAM_MAX_LAG_SECONDS = float(os.getenv("CHORD_STREAM_MAX_LAG_SECONDS", "30"))
+
+# Chord qualities as semitone intervals from the root. Order matters: on equal
+# scores the earlier template wins, matching the original per-template loop.
+CHORD_VOCABULARIES = {
+    "majmin": [
+        ("", (0, 4, 7)),
+        ("m", (0, 3, 7)),
+    ],
+    "extended": [
+        ("", (0, 4, 7)),
+        ("m", (0, 3, 7)),
+        ("7", (0, 4, 7, 10)),
+        ("maj7", (0, 4, 7, 11)),
+        ("m7", (0, 3, 7, 10)),
+        ("dim", (0, 3, 6)),
+        ("aug", (0, 4, 8)),
+        ("sus2", (0, 2, 7)),
+        ("sus4", (0, 5, 7)),
+    ],
+}
+
+def logsumexp(x, axis=0):
+    peak = x.max(axis=axis, keepdims=True)
+    return peak + np.log(np.exp(x - peak).sum(axis=axis, keepdims=True))
+
+
+def viterbi_path(log_likelihood, switch_penalty):
+    """
+    Most likely state per step for [states, steps] log-likelihoods when staying
+    in a state is free and moving to any other costs `switch_penalty`.
+
+    With uniform switching costs the best predecessor of a state is either the
+    state itself or the overall best one, so each step is O(states) vector work
+    instead of a states x states transition matrix.
+    """
+    n_states, n_steps = log_likelihood.shape
+    states = np.arange(n_states)
+    backpointers = np.empty((n_steps, n_states), dtype=np.intp)
+    score = log_likelihood[:, 0].copy()
+    for t in range(1, n_steps):
+        best = int(np.argmax(score))
+        switch = score[best] - switch_penalty
+        backpointers[t] = np.where(score >= switch, states, best)
+        np.maximum(score, switch, out=score)
+        score += log_likelihood[:, t]
+
+    path = np.empty(n_steps, dtype=np.intp)
+    path[-1] = int(np.argmax(score))
+    for t in range(n_steps - 1, 0, -1):
+        path[t - 1] = backpointers[t, path[t]]
+    return path
+
+
+class OnlineViterbi:
+    """
+    `viterbi_path` fed a block of steps at a time. Steps are committed as soon as
+    every surviving path agrees on them, which with a switch penalty happens a
+    few steps behind the input, so memory holds only the undecided tail.
+    """
+
+    def __init__(self, n_states, switch_penalty, max_lag):
+        self.states = np.arange(n_states)
+        self.switch_penalty = switch_penalty
+        self.max_lag = max(max_lag, 1)
+        self.score = None
+        self.backpointers = []  # one per pending step; the first points into already-committed steps
+        self.log_probs = []
+
+    def push(self, log_likelihood):
+        """Add [states, steps] log-likelihoods; returns the newly committed [(state, log_prob)]."""
+        for column in log_likelihood.T:
+            if self.score is None:
+                self.score = column.copy()
+                self.backpointers.append(None)
+            else:
+                best = int(np.argmax(self.score))
+                switch = self.score[best] - self.switch_penalty
+                self.backpointers.append(np.where(self.score >= switch, self.states, best))
+                np.maximum(self.score, switch, out=self.score)
+                self.score += column
+            self.log_probs.append(column)
+        return self._commit(final=False)
+
+    def finish(self):
+        return self._commit(final=True)
+
+    def _trace(self, state, end):
+        """States of pending steps 0..end on the path through `state` at step `end`."""
+        path = [state]
+        for t in range(end, 0, -1):
+            state = int(self.backpointers[t][state])
+            path.append(state)
+        return path[::-1]
+
+    def _commit(self, final):
+        pending = len(self.backpointers)
+        if not pending:
+            return []
+        if final:
+            end, state = pending - 1, int(np.argmax(self.score))
+        else:
+            # Walk every state's path back until they all pass through one state
+            end = None
+            current = self.states
+            for t in range(pending - 1, 0, -1):
+                current = self.backpointers[t][current]
+                if (current == current[0]).all():
+                    end, state = t - 1, int(current[0])
+                    break
+            if end is None:
+                if pending <= self.max_lag:
+                    return []
+                # Paths still disagree after max_lag steps: settle the older half on the current best
+                end = pending - 1 - self.max_lag // 2
+                state = self._trace(int(np.argmax(self.score)), pending - 1)[end]
+
+        path = self._trace(state, end)
+        committed = [(s, float(self.log_probs[t][s])) for t, s in enumerate(path)]
+        del self.backpointers[:end + 1]
+        del self.log_probs[:end + 1]
+        return committed
+
+
 class ChordService:
     def __init__(self):
         self.chroma_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        self.templates = self._build_templates()
+        self.template_sets = {
+            vocabulary: self._build_templates(qualities)
+            for vocabulary, qualities in CHORD_VOCABULARIES.items()
+        }
+        names, matrix = self.template_sets["majmin"]
+        self.templates = dict(zip(names, matrix))
 
-    def _build_templates(self):
-        templates = {}
+    def _build_templates(self, qualities):
+        """Returns (names, matrix) with one L2-normalised 12-bin template per row."""
+        names = []
+        rows = []
         for i, name in enumerate(self.chroma_names):
-            # Major: 0, 4, 7
-            major = np.zeros(12)
-            major[i] = 1
-            major[(i + 4) % 12] = 1
-            major[(i + 7) % 12] = 1
-            templates[f"{name}"] = major / np.linalg.norm(major)
-            
-            # Minor: 0, 3, 7
-            minor = np.zeros(12)
-            minor[i] = 1
-            minor[(i + 3) % 12] = 1
-            minor[(i + 7) % 12] = 1
-            templates[f"{name}m"] = minor / np.linalg.norm(minor)
-        return templates
-
-    def detect_chords(self, file_path):
+            for suffix, intervals in qualities:
+                template = np.zeros(12)
+                template[[(i + step) % 12 for step in intervals]] = 1
+                names.append(f"{name}{suffix}")
+                rows.append(template / np.linalg.norm(template))
+        return names, np.vstack(rows)
+
+    def analysis_params(self, vocabulary="majmin", switch_penalty=None, beat_sync=False):
+        """Parameters that identify a detect_chords result for persistence."""
+        return {
+            "version": ANALYSIS_VERSION,
+            "vocabulary": vocabulary,
+            "sr": ANALYSIS_SR,
+            "hop_length": HOP_LENGTH,
+            "switch_penalty": DEFAULT_SWITCH_PENALTY if switch_penalty is None else float(switch_penalty),
+            "beat_sync": bool(beat_sync),
+        }
+
+    def detect_chords(self, file_path, vocabulary="majmin", features=None, switch_penalty=None, beat_sync=False):
         """
-        Analyzes an audio file and returns a list of chords with timestamps.
+        Analyzes an audio file and returns a list of chords with timestamps and
+        a 0-1 confidence per segment. Frames (or beats, with `beat_sync`) are
+        decoded with Viterbi smoothing; `switch_penalty` overrides how strongly
+        chord changes are discouraged. Pass `features` to share decoded audio
+        and chroma with other analyses.
         """
         logger.info(f"[CHORD] Starting analysis for: {file_path}")
         if not os.path.exists(file_path):
             logger.error(f"[CHORD] File not found: {file_path}")
             return []
+        if vocabulary not in self.template_sets:
+            raise ValueError(f"Unknown chord vocabulary '{vocabulary}'. Available: {', '.join(self.template_sets)}")
 
         try:
-            # Load audio (mono, 22050Hz)
-            y, sr = librosa.load(file_path, sr=22050)
-            logger.info(f"[CHORD] Audio loaded. Duration: {len(y)/sr:.2f}s")
+            features = features or StemFeatures(file_path)
+            logger.info(f"[CHORD] Audio loaded. Duration: {features.duration:.2f}s")
             
             # Compute chroma cens (more robust to dynamics and timbre)
-            chroma = librosa.feature.chroma_cens(y=y, sr=sr)
+            chroma = features.chroma
             logger.info(f"[CHORD] Chroma computed. Shape: {chroma.shape}")
             
-            # Estimate chords per frame
-            chord_sequence = []
-            hop_length = 512
-            times = librosa.frames_to_time(np.arange(chroma.shape[1]), sr=sr, hop_length=hop_length)
+            if chroma.shape[1] == 0:
+                return []
+            times = features.frame_times(chroma.shape[1])
+            # Frames each decoding step stands for, so the penalty means the same per second either way
+            weights = np.ones(chroma.shape[1])
             
-            last_chord = None
+            if beat_sync:
+                # One step per beat: chords then change on the beat grid
+                bounds = librosa.util.fix_frames(features.beat_track[1], x_min=0, x_max=chroma.shape[1])
+                chroma = librosa.util.sync(chroma, bounds, aggregate=np.median)
+                times = times[bounds[:-1]]
+                weights = np.diff(bounds).astype(float)
             
-            for i in range(chroma.shape[1]):
-                frame_chroma = chroma[:, i]
-                norm = np.linalg.norm(frame_chroma)
-                if norm > 0:
-                    frame_chroma = frame_chroma / norm
-                
-                best_chord = "Unknown"
-                best_sim = -1
-                
-                for name, template in self.templates.items():
-                    sim = np.dot(frame_chroma, template)
-                    if sim > best_sim:
-                        best_sim = sim
-                        best_chord = name
-                
-                if best_chord != last_chord:
-                    chord_sequence.append({
-                        "time": round(float(times[i]), 2),
-                        "chord": best_chord
-                    })
-                    last_chord = best_chord
+            # Score every step against every template in one matrix multiply
+            names, matrix = self.template_sets[vocabulary]
+            norms = np.linalg.norm(chroma, axis=0)
+            chroma = chroma / np.where(norms > 0, norms, 1)
+            scores = EMISSION_SCALE * (matrix @ chroma)
+            log_probs = scores - logsumexp(scores, axis=0)
             
-            # Remove short flickers
-            refined_sequence = []
-            if chord_sequence:
-                refined_sequence.append(chord_sequence[0])
-                for i in range(1, len(chord_sequence)):
-                    duration = chord_sequence[i]['time'] - chord_sequence[i-1]['time']
-                    if duration > 0.3: # Increased threshold slightly
-                        refined_sequence.append(chord_sequence[i])
+            penalty = DEFAULT_SWITCH_PENALTY if switch_penalty is None else float(switch_penalty)
+            path = viterbi_path(log_probs * weights, penalty)
+            
+            # Segment wherever the decoded chord changes; confidence is the chord's mean probability over the segment
+            changes = np.flatnonzero(np.r_[True, path[1:] != path[:-1]])
+            chosen = np.exp(log_probs[path, np.arange(path.size)]) * weights
+            confidence = np.add.reduceat(chosen, changes) / np.add.reduceat(weights, changes)
+            refined_sequence = [
+                {"time": round(float(times[start]), 2), "chord": names[path[start]], "confidence": round(float(conf), 3)}
+                for start, conf in zip(changes, confidence)
+            ]
             
             logger.info(f"[CHORD] Analysis complete. Found {len(refined_sequence)} chord changes.")
             return refined_sequence
@@ -96,4 +243,70 @@ class ChordService:
             logger.error(f"[CHORD] Detection error: {str(e)}")
             raise e
 
+    def stream_chords(self, file_path, vocabulary="majmin", switch_penalty=None, block_seconds=STREAM_BLOCK_SECONDS):
+        """
+        Generator over chord segments, each yielded once decoding has settled on it,
+        reading the stem block by block so memory stays flat whatever its length.
+        Chroma comes from each block's STFT rather than CENS (which smooths across
+        block edges), so results can differ slightly from detect_chords.
+        """
+        if vocabulary not in self.template_sets:
+            raise ValueError(f"Unknown chord vocabulary '{vocabulary}'. Available: {', '.join(self.template_sets)}")
+        names, matrix = self.template_sets[vocabulary]
+        sr = sf.info(file_path).samplerate
+        # Same frame rate as detect_chords at its 22050Hz analysis rate
+        hop_length = int(round(sr * HOP_LENGTH / ANALYSIS_SR))
+        n_fft = 4 * hop_length
+        penalty = DEFAULT_SWITCH_PENALTY if switch_penalty is None else float(switch_penalty)
+        decoder = OnlineViterbi(len(names), penalty, int(STREAM_MAX_LAG_SECONDS * sr / hop_length))
+        logger.info(f"[CHORD] Streaming analysis for: {file_path}")
+
+        # Frames with center=False: the padding of the last block isn't audio
+        total_frames = max(0, 1 + (sf.info(file_path).frames - n_fft) // hop_length)
+        segment = None  # [start frame, state, probability sum, frames]
+        frame = 0
+
+        def finished():
+            start = segment[0]
+            return {
+                # Frame centres, like detect_chords; the first segment starts the track
+                "time": round((start * hop_length + n_fft / 2) / sr, 2) if start else 0.0,
+                "chord": names[segment[1]],
+                "confidence": round(float(segment[2] / segment[3]), 3),
+            }
+
+        def settle(committed):
+            nonlocal segment, frame
+            for state, log_prob in committed:
+                if segment is not None and state != segment[1]:
+                    yield finished()
+                    segment = None
+                if segment is None:
+                    segment = [frame, state, 0.0, 0]
+                segment[2] += np.exp(log_prob)
+                segment[3] += 1
+                frame += 1
+
+        blocks = librosa.stream(
+            file_path, block_length=max(1, int(block_seconds * sr / hop_length)),
+            frame_length=n_fft, hop_length=hop_length, mono=True, fill_value=0
+        )
+        decoded = 0
+        for y in blocks:
+            power = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, center=False)) ** 2
+            power = power[:, :max(0, total_frames - decoded)]
+            if power.shape[1] == 0:
+                break
+            decoded += power.shape[1]
+            # Fixed tuning: estimating it per block would shift bins between blocks
+            chroma = librosa.feature.chroma_stft(S=power, sr=sr, n_fft=n_fft, tuning=0.0)
+            norms = np.linalg.norm(chroma, axis=0)
+            chroma = chroma / np.where(norms > 0, norms, 1)
+            scores = EMISSION_SCALE * (matrix @ chroma)
+            yield from settle(decoder.push(scores - logsumexp(scores, axis=0)))
+
+        yield from settle(decoder.finish())
+        if segment is not None:
+            yield finished()
+
 chord_service = ChordService()
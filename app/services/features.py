@@ -0,0 +1,61 @@
+import librosa
+import numpy as np
+from . import pcm_store
+
+ANALYSIS_SR = 22050
+HOP_LENGTH = 512
+N_FFT = 2048
+
+
+class StemFeatures:
+    """
+    Audio features of one stem, each computed on first use and then shared by
+    every analysis run against this object: one PCM read, one STFT, one chroma.
+    """
+
+    def __init__(self, path, sr=ANALYSIS_SR, hop_length=HOP_LENGTH):
+        self.path = path
+        self.sr = sr
+        self.hop_length = hop_length
+        self._cache = {}
+
+    def _get(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def y(self):
+        # Mono PCM at the analysis rate, decoded and resampled once per file (see pcm_store)
+        return self._get("y", lambda: np.asarray(pcm_store.load(self.path, sr=self.sr, mono=True)))
+
+    @property
+    def duration(self):
+        return len(self.y) / self.sr
+
+    @property
+    def power_spectrogram(self):
+        return self._get("power", lambda: np.abs(librosa.stft(self.y, n_fft=N_FFT, hop_length=self.hop_length)) ** 2)
+
+    @property
+    def chroma(self):
+        """Chroma CENS (robust to dynamics and timbre), [12, frames]."""
+        return self._get("chroma", lambda: librosa.feature.chroma_cens(y=self.y, sr=self.sr, hop_length=self.hop_length))
+
+    @property
+    def onset_envelope(self):
+        def compute():
+            mel = librosa.feature.melspectrogram(S=self.power_spectrogram, sr=self.sr)
+            return librosa.onset.onset_strength(S=librosa.power_to_db(mel, ref=np.max), sr=self.sr, hop_length=self.hop_length)
+        return self._get("onset_envelope", compute)
+
+    @property
+    def beat_track(self):
+        """(tempo in BPM, beat frame indices) from the onset envelope."""
+        def compute():
+            tempo, frames = librosa.beat.beat_track(onset_envelope=self.onset_envelope, sr=self.sr, hop_length=self.hop_length)
+            return float(np.atleast_1d(tempo)[0]), np.asarray(frames, dtype=int)
+        return self._get("beat_track", compute)
+
+    def frame_times(self, count):
+        return librosa.frames_to_time(np.arange(count), sr=self.sr, hop_length=self.hop_length)
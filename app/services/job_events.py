@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import select
+import threading
+from sqlalchemy import text
+from ..database import engine
+from .status_cache import job_status_cache, TERMINAL_STATUSES
+
+# "memory" delivers within this process only; "postgres" fans out through
+# LISTEN/NOTIFY so API nodes see transitions published by separate workers.
+EVENTS_BACKEND = os.getenv("JOB_EVENTS_BACKEND", "memory")
+NOTIFY_CHANNEL = "job_events"
+
+
+def job_snapshot(job):
+    """Public view of a job, shared by the status endpoint and the event stream."""
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "progress": job.progress,
+        "stems": job.stems,
+        "error": job.error_message
+    }
+
+
+class Subscription:
+    def __init__(self, broker, job_id, loop):
+        self.broker = broker
+        self.job_id = job_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=64)
+
+    def _offer(self, snapshot):
+        # Snapshots supersede each other, so under backpressure drop the oldest
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(snapshot)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+
+class InProcessBackend:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, snapshot):
+        self.broker._deliver(snapshot)
+
+    def start(self):
+        pass
+
+
+class PostgresNotifyBackend:
+    def __init__(self, broker):
+        self.broker = broker
+        self._thread = None
+
+    def publish(self, snapshot):
+        # Delivery to local subscribers happens when our own NOTIFY comes back
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": NOTIFY_CHANNEL, "payload": json.dumps(snapshot)})
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="job-events-listener", daemon=True)
+            self._thread.start()
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = engine.raw_connection()
+                # Keep this long-lived autocommit connection out of the pool
+                conn.detach()
+                dbapi_conn = conn.driver_connection
+                dbapi_conn.autocommit = True
+                with dbapi_conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                print("[EVENTS] Listening for job events on Postgres")
+                while True:
+                    if select.select([dbapi_conn], [], [], 30) == ([], [], []):
+                        continue
+                    dbapi_conn.poll()
+                    while dbapi_conn.notifies:
+                        note = dbapi_conn.notifies.pop(0)
+                        self.broker._deliver(json.loads(note.payload))
+            except Exception as e:
+                print(f"[EVENTS] Listener error, reconnecting: {e}")
+                threading.Event().wait(5)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+class JobEventBroker:
+    """Fans job status/progress snapshots out to SSE and WebSocket subscribers."""
+
+    def __init__(self, backend=EVENTS_BACKEND):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.backend = PostgresNotifyBackend(self) if backend == "postgres" else InProcessBackend(self)
+
+    def start(self):
+        self.backend.start()
+
+    def subscribe(self, job_id):
+        """Register interest in `job_id`. Must be called from the event loop that will consume it."""
+        sub = Subscription(self, job_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.job_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.job_id]
+
+    def publish(self, snapshot):
+        """Safe to call from any thread; never raises into the publishing job."""
+        try:
+            self.backend.publish(snapshot)
+        except Exception as e:
+            print(f"[EVENTS] Failed to publish event for job {snapshot.get('id')}: {e}")
+
+    def _deliver(self, snapshot):
+        # Every transition this process hears about keeps the status cache current
+        job_status_cache.put_nowait(snapshot)
+        with self._lock:
+            subs = list(self._subscribers.get(snapshot.get("id"), ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, snapshot)
+            except RuntimeError:
+                # Subscriber's loop already closed
+                self._unsubscribe(sub)
+
+
+job_events = JobEventBroker()
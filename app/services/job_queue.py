@@ -0,0 +1,120 @@
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models.job import Job
+from .job_events import job_events, job_snapshot
+
+# "inline" runs separation in the API process via BackgroundTasks,
+# "worker" leaves pending rows for `python -m app.worker` to claim.
+EXECUTION_MODE = os.getenv("JOB_EXECUTION_MODE", "inline")
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+STALE_AFTER_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def claim_next_job(db: Session, worker_id: str):
+    """
+    Atomically move the oldest pending job to processing and return it, or None if the queue is empty.
+    """
+    if db.bind.dialect.name == "postgresql":
+        job = (
+            db.query(Job)
+            .filter(Job.status == "pending")
+            .order_by(Job.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if not job:
+            db.rollback()
+            return None
+        job.status = "processing"
+        job.worker_id = worker_id
+        job.heartbeat_at = _now()
+        job.attempts = (job.attempts or 0) + 1
+        db.commit()
+        return job
+
+    # SQLite has no row locks; a conditional UPDATE works as compare-and-swap
+    # since writes are serialised on the database file.
+    for _ in range(5):
+        candidate = db.query(Job.id).filter(Job.status == "pending").order_by(Job.id).first()
+        if not candidate:
+            return None
+        claimed = (
+            db.query(Job)
+            .filter(Job.id == candidate.id, Job.status == "pending")
+            .update(
+                {
+                    Job.status: "processing",
+                    Job.worker_id: worker_id,
+                    Job.heartbeat_at: _now(),
+                    Job.attempts: func.coalesce(Job.attempts, 0) + 1,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if claimed:
+            return db.query(Job).filter(Job.id == candidate.id).first()
+    return None
+
+
+def heartbeat(db: Session, job_id: int, worker_id: str):
+    db.query(Job).filter(Job.id == job_id, Job.worker_id == worker_id, Job.status == "processing").update(
+        {Job.heartbeat_at: _now()}, synchronize_session=False
+    )
+    db.commit()
+
+
+def fail_attempt(job: Job, error_message: str):
+    """
+    Record a failed attempt on `job`; the caller commits and publishes. Worker-mode
+    jobs with attempts left go back to pending with no error, so nobody is ever
+    told "failed" about a job that will run again. Returns True if re-queued.
+    """
+    job.worker_id = None
+    if EXECUTION_MODE == "worker" and (job.attempts or 0) < MAX_ATTEMPTS:
+        print(f"[QUEUE] Re-queuing job {job.id} (attempt {job.attempts}/{MAX_ATTEMPTS})")
+        job.status = "pending"
+        job.progress = 0.0
+        job.error_message = None
+        return True
+    job.status = "failed"
+    job.error_message = error_message
+    return False
+
+
+def finish_attempt(db: Session, job_id: int, worker_id: str):
+    """
+    Drop `worker_id`'s claim once its attempt is over. The outcome was already
+    recorded; a re-queued job may belong to another worker by now.
+    """
+    db.query(Job).filter(Job.id == job_id, Job.worker_id == worker_id).update(
+        {Job.worker_id: None}, synchronize_session=False
+    )
+    db.commit()
+
+
+def recover_stale_jobs(db: Session):
+    """
+    Re-queue processing jobs whose worker stopped heartbeating, failing those out of attempts.
+    Returns the number of jobs recovered.
+    """
+    cutoff = _now() - timedelta(seconds=STALE_AFTER_SECONDS)
+    stale = (
+        db.query(Job)
+        .filter(Job.status == "processing", Job.heartbeat_at != None, Job.heartbeat_at < cutoff)  # noqa: E711
+        .all()
+    )
+    for job in stale:
+        print(f"[QUEUE] Job {job.id} lost by {job.worker_id}")
+        fail_attempt(job, f"Worker lost after {job.attempts} attempts")
+    db.commit()
+    for job in stale:
+        job_events.publish(job_snapshot(job))
+    return len(stale)
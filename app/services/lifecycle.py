@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..models.job import Job
+from ..models.stem_cache import StemCacheEntry
+from .job_events import job_events, job_snapshot
+from .archives import ARCHIVE_DIRNAME
+from .stem_cache import stem_cache
+from .transcoder import DERIVED_DIRNAME
+from .status_cache import TERMINAL_STATUSES
+from .storage import storage, UPLOADS_DIR, PARTIAL_DIR, STEMS_DIR, PCM_DIR
+
+# Age limits; 0 keeps that kind of data forever. Stem age counts from the last download or playback.
+UPLOAD_TTL_HOURS = float(os.getenv("STORAGE_UPLOAD_TTL_HOURS", "24"))
+SESSION_TTL_HOURS = float(os.getenv("STORAGE_SESSION_TTL_HOURS", "24"))
+STEM_TTL_HOURS = float(os.getenv("STORAGE_STEM_TTL_HOURS", "168"))
+GC_INTERVAL_SECONDS = float(os.getenv("STORAGE_GC_INTERVAL_SECONDS", "600"))
+# Over the high watermark of the quota, least recently used data is evicted down to the low one
+HIGH_WATERMARK = float(os.getenv("STORAGE_GC_HIGH_WATERMARK", "0.9"))
+LOW_WATERMARK = float(os.getenv("STORAGE_GC_LOW_WATERMARK", "0.8"))
+
+
+def _files(path):
+    try:
+        return [e for e in os.scandir(path) if e.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+def _size(entry):
+    try:
+        return entry.stat().st_size
+    except OSError:
+        return 0
+
+
+def _stem_dirs():
+    try:
+        return [e.path for e in os.scandir(STEMS_DIR) if e.is_dir() and e.name.isdigit()]
+    except FileNotFoundError:
+        return []
+
+
+class LifecycleCollector:
+    """
+    Background garbage collection for everything under storage: uploads and
+    abandoned upload sessions by age, stem directories by time since last
+    access, and least recently used data whenever disk use nears the quota.
+    Regenerable data (decoded PCM, renditions) goes before anything else.
+    """
+
+    def __init__(self, interval=GC_INTERVAL_SECONDS):
+        self.interval = interval
+        self._wake = None
+        self._task = None
+        self._session_listeners = []
+
+    def collect(self):
+        """Blocking: one full collection pass. Returns counts of what was removed."""
+        stats = {"uploads": 0, "sessions": 0, "expired_jobs": 0, "evicted": 0}
+        db = SessionLocal()
+        try:
+            now = time.time()
+            self._collect_uploads(db, now, stats)
+            self._collect_sessions(now, stats)
+            self._collect_stems(db, now, stats)
+            self._enforce_quota(db, stats)
+        finally:
+            db.close()
+        if any(stats.values()):
+            print(f"[GC] Collected {stats}, {storage.usage(refresh=True) // (1024 * 1024)}MB in use")
+        return stats
+
+    def _collect_uploads(self, db: Session, now, stats):
+        if not UPLOAD_TTL_HOURS:
+            return
+        # Inputs of jobs that may still run (or be retried) stay put
+        in_use = {path for (path,) in db.query(Job.input_path).filter(Job.status.in_(["pending", "processing"])).all()}
+        cutoff = now - UPLOAD_TTL_HOURS * 3600
+        for entry in _files(UPLOADS_DIR):
+            if entry.stat().st_mtime < cutoff and entry.path not in in_use:
+                storage.remove(entry.path)
+                stats["uploads"] += 1
+
+    def _collect_sessions(self, now, stats):
+        if not SESSION_TTL_HOURS:
+            return
+        cutoff = now - SESSION_TTL_HOURS * 3600
+        for entry in _files(PARTIAL_DIR):
+            if entry.stat().st_mtime < cutoff:
+                storage.evict_local(entry.path)
+                stats["sessions"] += 1
+                upload_id = os.path.splitext(entry.name)[0]
+                for listener in self._session_listeners:
+                    listener(upload_id)
+
+    def on_session_removed(self, listener):
+        """Call `listener(upload_id)` for each upload session file the collector deletes."""
+        self._session_listeners.append(listener)
+
+    def _collect_stems(self, db: Session, now, stats):
+        if not STEM_TTL_HOURS:
+            return
+        cutoff = now - STEM_TTL_HOURS * 3600
+        for path in _stem_dirs():
+            if storage.last_access(path) < cutoff and self.expire_stem_dir(db, path):
+                stats["expired_jobs"] += 1
+
+    def expire_stem_dir(self, db: Session, path):
+        """
+        Delete a job's stem directory and mark every job pointing at it (the owner
+        and any served from its cache entry) as expired. Skipped while any of them
+        is still running.
+        """
+        entry = db.query(StemCacheEntry).filter(StemCacheEntry.stems_dir == path).first()
+        conditions = [Job.id == int(os.path.basename(path))]
+        if entry:
+            conditions.append(Job.cache_key == entry.cache_key)
+        jobs = db.query(Job).filter(or_(*conditions)).all()
+        if any(job.status not in TERMINAL_STATUSES for job in jobs):
+            return False
+
+        for job in jobs:
+            if job.status == "completed":
+                job.status = "expired"
+                job.stems = None
+        db.commit()
+        if entry:
+            # The cache owns the directory: releasing every job's reference purges it
+            stem_cache.expire(db, entry, jobs)
+        else:
+            storage.remove(path)
+        for job in jobs:
+            job_events.publish(job_snapshot(job))
+        print(f"[GC] Expired stems in {path} ({len(jobs)} jobs)")
+        return True
+
+    def _enforce_quota(self, db: Session, stats):
+        if not storage.quota_bytes:
+            return
+        usage = storage.usage(refresh=True)
+        if usage <= storage.quota_bytes * HIGH_WATERMARK:
+            return
+        target = storage.quota_bytes * LOW_WATERMARK
+
+        # Cheapest first: decoded PCM, renditions and ZIP exports are rebuilt on demand
+        regenerable = [(e.stat().st_mtime, _size(e), e.path) for e in _files(PCM_DIR)]
+        for path in _stem_dirs():
+            derived = os.path.join(path, DERIVED_DIRNAME)
+            for directory in (derived, os.path.join(derived, ARCHIVE_DIRNAME)):
+                regenerable += [(e.stat().st_mtime, _size(e), e.path) for e in _files(directory)]
+        for _, size, path in sorted(regenerable):
+            if usage <= target:
+                return
+            storage.evict_local(path)
+            usage -= size
+            stats["evicted"] += 1
+
+        # Then whole stem directories, least recently accessed first. With a remote
+        # backend only the local copy goes; otherwise the jobs expire.
+        for path in sorted(_stem_dirs(), key=storage.last_access):
+            if usage <= target:
+                return
+            size = sum(_size(e) for e in os.scandir(path) if e.is_file())
+            if storage.remote:
+                storage.evict_local(path)
+            elif not self.expire_stem_dir(db, path):
+                continue
+            usage -= size
+            stats["evicted"] += 1
+
+    def request_collection(self):
+        """Run a pass soon, e.g. after an upload was refused for lack of space."""
+        if self._wake:
+            self._wake.set()
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.collect)
+            except Exception as e:
+                print(f"[GC] Collection failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+
+lifecycle_collector = LifecycleCollector()
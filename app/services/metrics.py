@@ -0,0 +1,307 @@
+import bisect
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from .storage import METRICS_DIR
+
+# Prometheus text exposition without the client library. Recording a sample is a
+# dict lookup, a bucket search and a short lock; gauges are read from their
+# sources only when /metrics is scraped, so an unscraped process pays next to nothing.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# How often worker processes publish their series for the API's /metrics to merge in
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "15"))
+# Snapshots untouched this long belong to exited processes: their counters and
+# histograms are folded into one retained-totals file and the snapshots deleted
+METRICS_SNAPSHOT_RETENTION_SECONDS = float(os.getenv("METRICS_SNAPSHOT_RETENTION_SECONDS", "3600"))
+RETAINED_TOTALS_FILENAME = "retained-totals.state"
+
+# Seconds; wide enough for both DB round trips and whole separation stages
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self):
+        """{label values: value} as of now."""
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time by `collect()` returning {label values: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def replace(self, values):
+        """Swap in a whole new set of series, dropping label values no longer present."""
+        with self._lock:
+            self._values = dict(values)
+
+    def values(self):
+        if self.collect:
+            try:
+                return dict(self.collect())
+            except Exception as e:
+                print(f"[METRICS] Collecting {self.name} failed: {e}")
+                return {}
+        return super().values()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum; cumulated on render
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class MetricsRegistry:
+    """
+    Every metric of this process, rendered in the Prometheus text format. Worker
+    processes have no HTTP server of their own: they write periodic snapshots to
+    METRICS_DIR and the API merges them into its scrape. Counters and histograms
+    of exited workers are kept so totals never go backwards; their gauges are
+    dropped once the snapshot goes stale, and after METRICS_SNAPSHOT_RETENTION_SECONDS
+    the rest is compacted into the retained totals. Workers on other hosts need a
+    shared STORAGE_ROOT to be included.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._writer = None
+
+    def _register(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self._register(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _snapshot_path(self):
+        return os.path.join(METRICS_DIR, f"{socket.gethostname()}-{os.getpid()}.json")
+
+    def write_snapshot(self):
+        snapshot = {
+            "written_at": time.time(),
+            "metrics": {name: [[list(key), value] for key, value in metric.values().items()] for name, metric in self._metrics.items()},
+        }
+        path = self._snapshot_path()
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def start_snapshot_writer(self, interval=METRICS_FLUSH_SECONDS):
+        """Publish this process's metrics every `interval` seconds (worker processes)."""
+        if not METRICS_ENABLED or self._writer is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    print(f"[METRICS] Snapshot write failed: {e}")
+
+        self._writer = threading.Thread(target=loop, name="metrics-snapshot", daemon=True)
+        self._writer.start()
+
+    @contextmanager
+    def _dir_lock(self, mode):
+        """Shared while reading the snapshots, exclusive while compacting them, across processes."""
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(os.path.join(METRICS_DIR, ".lock"), "a") as lock:
+            fcntl.flock(lock, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _snapshots(self):
+        """(path, snapshot) for every other process's snapshot."""
+        own = self._snapshot_path()
+        try:
+            entries = [e.path for e in os.scandir(METRICS_DIR) if e.name.endswith(".json") and e.path != own]
+        except FileNotFoundError:
+            return
+        for path in entries:
+            snapshot = self._read(path)
+            if snapshot is not None:
+                yield path, snapshot
+
+    def _merge(self, merged, snapshot, gauges):
+        """Add a snapshot's series into `merged`; gauges only when `gauges` (they don't sum across time)."""
+        for name, series in snapshot.get("metrics", {}).items():
+            metric = self._metrics.get(name)
+            if metric is None or (metric.kind == "gauge" and not gauges):
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in series:
+                key = tuple(key)
+                current = values.get(key)
+                if current is None:
+                    values[key] = value
+                elif metric.kind == "histogram":
+                    if len(current) == len(value):
+                        values[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    values[key] = current + value
+
+    def _compact(self, expired):
+        """Fold the counters and histograms of expired snapshots into the retained totals, then delete them."""
+        retained_path = os.path.join(METRICS_DIR, RETAINED_TOTALS_FILENAME)
+        with self._dir_lock(fcntl.LOCK_EX):
+            totals = {}
+            self._merge(totals, self._read(retained_path) or {}, gauges=False)
+            compacted = []
+            for path in expired:
+                # Re-read under the lock: another process may have compacted it already
+                snapshot = self._read(path)
+                if snapshot is not None:
+                    self._merge(totals, snapshot, gauges=False)
+                    compacted.append(path)
+            if not compacted:
+                return
+            tmp_path = f"{retained_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"metrics": {name: [[list(key), value] for key, value in series.items()] for name, series in totals.items()}}, f)
+            os.replace(tmp_path, retained_path)
+            for path in compacted:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        print(f"[METRICS] Compacted {len(compacted)} snapshots of exited processes into the retained totals")
+
+    def collect(self):
+        """{name: {label values: value}} for this process plus every worker snapshot."""
+        merged = {name: metric.values() for name, metric in self._metrics.items()}
+        now = time.time()
+        stale_before = now - 3 * METRICS_FLUSH_SECONDS
+        expired = []
+        try:
+            # Shared lock: a compaction moving series into the retained totals is never seen half done
+            with self._dir_lock(fcntl.LOCK_SH):
+                self._merge(merged, self._read(os.path.join(METRICS_DIR, RETAINED_TOTALS_FILENAME)) or {}, gauges=False)
+                for path, snapshot in self._snapshots():
+                    written_at = snapshot.get("written_at", 0)
+                    if written_at < now - METRICS_SNAPSHOT_RETENTION_SECONDS:
+                        expired.append(path)
+                    self._merge(merged, snapshot, gauges=written_at >= stale_before)
+            if expired:
+                self._compact(expired)
+        except OSError as e:
+            print(f"[METRICS] Reading worker snapshots failed: {e}")
+        return merged
+
+    def render(self):
+        """Blocking (reads worker snapshots): the exposition text for a scrape."""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self._metrics[name]
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(values.items()):
+                labels = dict(zip(metric.labelnames, key))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else repr(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def start_snapshot_writer():
+    """Process pool initializer: children publish their metrics like workers do."""
+    metrics.start_snapshot_writer()
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from audio_separator.separator import Separator
+from .metrics import metrics
+from .progress import stage_timer
+from .storage import STEMS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration
+MAX_PER_MODEL = int(os.getenv("MODEL_POOL_MAX_PER_MODEL", "1"))
+MEMORY_BUDGET_MB = int(os.getenv("MODEL_POOL_MEMORY_MB", "4096"))
+MODEL_FILE_DIR = os.getenv("MODEL_FILE_DIR", "/tmp/audio-separator-models/")
+# Container for separated stems; FLAC masters are lossless at roughly half the size of WAV
+OUTPUT_FORMAT = os.getenv("STEM_MASTER_FORMAT", "WAV").upper()
+PRELOAD_MODELS = [m.strip() for m in os.getenv("MODEL_PRELOAD", "").split(",") if m.strip()]
+
+# Approximate resident size of a loaded separator, used against the memory budget.
+MODEL_MEMORY_ESTIMATES_MB = {
+    "htdemucs_6s.yaml": 1200,
+    "UVR_MDXNET_KARA_2.onnx": 400,
+}
+DEFAULT_MODEL_MEMORY_MB = 800
+
+MODEL_LOAD_SECONDS = metrics.histogram("forge_model_load_seconds", "Time to load a separator model", ["model"])
+INFERENCE_SECONDS = metrics.histogram(
+    "forge_inference_seconds", "Separator inference per run (a whole input or one window), excluding decode and writes", ["model"]
+)
+
+
+@contextmanager
+def _instrumented(instance, timings, on_stem=None):
+    """
+    Time the model instance's input decode (prepare_mix) and stem writes (final_process).
+    `on_stem(stem_name, source)` sees each stem's array just before it is written.
+    """
+    if timings is None and on_stem is None:
+        yield
+        return
+
+    prepare_mix = instance.prepare_mix
+    final_process = instance.final_process
+
+    def timed_prepare_mix(*args, **kwargs):
+        with stage_timer(timings, "decode"):
+            return prepare_mix(*args, **kwargs)
+
+    def timed_final_process(stem_path, source, stem_name):
+        if on_stem:
+            on_stem(stem_name, source)
+        with stage_timer(timings, "write"):
+            return final_process(stem_path, source, stem_name)
+
+    instance.prepare_mix = timed_prepare_mix
+    instance.final_process = timed_final_process
+    try:
+        yield
+    finally:
+        # Drop the instance attributes so the class methods show through again
+        del instance.prepare_mix
+        del instance.final_process
+
+
+def timed_separate(separator, file_path, timings=None, model_name=None):
+    """Run `separator.separate`, attributing time not spent in decode/write hooks to inference."""
+    if timings is None:
+        return separator.separate(file_path)
+    start = time.perf_counter()
+    before = timings.get("decode", 0.0) + timings.get("write", 0.0)
+    output_files = separator.separate(file_path)
+    hooked = timings.get("decode", 0.0) + timings.get("write", 0.0) - before
+    inference = max(time.perf_counter() - start - hooked, 0.0)
+    timings["inference"] = round(timings.get("inference", 0.0) + inference, 3)
+    if model_name:
+        INFERENCE_SECONDS.observe(inference, model=model_name)
+    return output_files
+
+
+class _PooledSeparator:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.separator = None
+        self.in_use = True
+        self.last_used = time.monotonic()
+        self.memory_mb = MODEL_MEMORY_ESTIMATES_MB.get(model_name, DEFAULT_MODEL_MEMORY_MB)
+
+
+class ModelPool:
+    """
+    Keeps loaded Separator instances warm across jobs.
+
+    Each instance is leased to one job at a time. At most `max_per_model`
+    instances exist per model name, and idle instances are evicted least
+    recently used first once the estimated memory budget is exceeded.
+    """
+
+    def __init__(self, max_per_model=MAX_PER_MODEL, memory_budget_mb=MEMORY_BUDGET_MB, model_file_dir=MODEL_FILE_DIR):
+        self.max_per_model = max(1, max_per_model)
+        self.memory_budget_mb = memory_budget_mb
+        self.model_file_dir = model_file_dir
+        self._entries = []
+        self._cond = threading.Condition()
+
+    def _memory_in_use(self):
+        return sum(e.memory_mb for e in self._entries)
+
+    def _evict_idle(self, needed_mb):
+        """Drop idle separators (LRU first) until `needed_mb` fits in the budget."""
+        idle = sorted((e for e in self._entries if not e.in_use), key=lambda e: e.last_used)
+        for entry in idle:
+            if self._memory_in_use() + needed_mb <= self.memory_budget_mb:
+                break
+            print(f"[POOL] Evicting idle model {entry.model_name}")
+            self._entries.remove(entry)
+            entry.separator = None
+        return self._memory_in_use() + needed_mb <= self.memory_budget_mb
+
+    def _load(self, model_name):
+        print(f"[POOL] Loading model {model_name}...")
+        start = time.time()
+        separator = Separator(
+            model_file_dir=self.model_file_dir,
+            output_dir=STEMS_DIR,
+            output_format=OUTPUT_FORMAT,
+        )
+        separator.load_model(model_name)
+        MODEL_LOAD_SECONDS.observe(time.time() - start, model=model_name)
+        print(f"[POOL] Model {model_name} loaded in {time.time() - start:.2f}s")
+        return separator
+
+    def acquire(self, model_name, timings=None):
+        """Lease a loaded separator for `model_name`, loading one if needed. Blocks while the pool is saturated."""
+        with self._cond:
+            while True:
+                idle = [e for e in self._entries if e.model_name == model_name and not e.in_use and e.separator]
+                if idle:
+                    entry = max(idle, key=lambda e: e.last_used)
+                    entry.in_use = True
+                    return entry
+
+                loaded = [e for e in self._entries if e.model_name == model_name]
+                if len(loaded) < self.max_per_model:
+                    entry = _PooledSeparator(model_name)
+                    # Load over budget only when nothing is running that could free memory,
+                    # otherwise a single oversized model would wait forever.
+                    if self._evict_idle(entry.memory_mb) or not any(e.in_use for e in self._entries):
+                        self._entries.append(entry)
+                        break
+
+                self._cond.wait()
+
+        try:
+            with stage_timer(timings, "model_load"):
+                entry.separator = self._load(model_name)
+        except Exception:
+            with self._cond:
+                self._entries.remove(entry)
+                self._cond.notify_all()
+            raise
+        return entry
+
+    def release(self, entry, discard=False):
+        with self._cond:
+            entry.in_use = False
+            entry.last_used = time.monotonic()
+            if discard and entry in self._entries:
+                self._entries.remove(entry)
+                entry.separator = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, model_name, output_dir, timings=None, on_stem=None):
+        entry = self.acquire(model_name, timings)
+        discard = False
+        try:
+            separator = entry.separator
+            # Separator copies output_dir into the model instance at load time
+            separator.output_dir = output_dir
+            separator.model_instance.output_dir = output_dir
+            with _instrumented(separator.model_instance, timings, on_stem):
+                yield separator
+        except Exception:
+            # A separator that failed mid-run may hold half-initialised state
+            discard = True
+            raise
+        finally:
+            self.release(entry, discard=discard)
+
+    def separate(self, model_name, output_dir, file_path, timings=None, on_stem=None):
+        """Blocking helper: run `file_path` through a pooled `model_name` separator writing into `output_dir`."""
+        os.makedirs(output_dir, exist_ok=True)
+        # Hooks only run with a timings dict, and inference time needs them subtracted
+        timings = {} if timings is None else timings
+        with self.lease(model_name, output_dir, timings, on_stem) as separator:
+            return timed_separate(separator, file_path, timings, model_name)
+
+    def separate_array(self, model_name, output_dir, mix, label_path, timings=None, on_stem=None):
+        """
+        Like `separate`, but the input is an in-memory [samples, channels] array at the
+        model's sample rate instead of a file to decode. `label_path` must be a readable
+        audio file of the same length: it names the outputs and the writer probes its duration.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        timings = {} if timings is None else timings
+        with self.lease(model_name, output_dir, timings, on_stem) as separator:
+            instance = separator.model_instance
+            previous = instance.__dict__.get("prepare_mix")
+            prepare_mix = instance.prepare_mix
+            # prepare_mix takes arrays as-is, so skip the decode by handing it ours
+            instance.prepare_mix = lambda _path: prepare_mix(mix)
+            try:
+                return timed_separate(separator, label_path, timings, model_name)
+            finally:
+                if previous is None:
+                    del instance.prepare_mix
+                else:
+                    instance.prepare_mix = previous
+
+    def preload(self, model_names):
+        for model_name in model_names:
+            try:
+                self.release(self.acquire(model_name))
+            except Exception as e:
+                print(f"[POOL] Failed to preload {model_name}: {e}")
+
+    def loaded_models(self):
+        with self._cond:
+            return [e.model_name for e in self._entries if e.separator]
+
+
+model_pool = ModelPool()
+
+
+def _loaded_model_counts():
+    counts = {}
+    for model_name in model_pool.loaded_models():
+        counts[(model_name,)] = counts.get((model_name,), 0) + 1
+    return counts
+
+
+metrics.gauge("forge_loaded_models", "Separator instances loaded in memory, by model", ["model"], collect=_loaded_model_counts)
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import struct
+import subprocess
+import threading
+import uuid
+import numpy as np
+import soundfile as sf
+from .storage import PCM_DIR
+
+# Every input is decoded once into canonical PCM (float32, stereo, at the
+# separator's rate) stored as .npy, and consumers memory-map it instead of
+# decoding again. Resampled/mono variants are derived from it once and cached too.
+PCM_CACHE_MAX_MB = int(os.getenv("PCM_CACHE_MAX_MB", "10240"))
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+_BLOCK_FRAMES = 1 << 18
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def _source_key(path):
+    """Identifies the bytes of `path`, so a replaced file never reuses stale PCM."""
+    st = os.stat(path)
+    ident = f"{os.path.realpath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+
+def pcm_path(path, sr=SAMPLE_RATE, mono=False):
+    layout = "mono" if mono else "stereo"
+    return os.path.join(PCM_DIR, f"{_source_key(path)}.{sr}.{layout}.npy")
+
+
+def _npy_header(frames):
+    """Fixed 128-byte .npy v1.0 header, so the frame count can be patched in after streaming."""
+    fields = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (frames, CHANNELS)
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", 118) + (fields.ljust(117) + "\n").encode("latin1")
+
+
+def _stereo(block):
+    if block.shape[1] == CHANNELS:
+        return block
+    if block.shape[1] == 1:
+        return np.repeat(block, CHANNELS, axis=1)
+    return block[:, :CHANNELS]
+
+
+def _soundfile_blocks(path):
+    """Blocks straight from libsndfile when the file is already at the canonical rate, else None."""
+    try:
+        info = sf.info(path)
+    except Exception:
+        return None
+    if info.samplerate != SAMPLE_RATE:
+        return None
+    return (_stereo(block) for block in sf.blocks(path, blocksize=_BLOCK_FRAMES, dtype="float32", always_2d=True))
+
+
+def _ffmpeg_blocks(path):
+    process = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path, "-vn",
+         "-f", "f32le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdout=subprocess.PIPE,
+    )
+    frame_bytes = 4 * CHANNELS
+    try:
+        remainder = b""
+        while True:
+            chunk = process.stdout.read(_BLOCK_FRAMES * frame_bytes)
+            if not chunk:
+                break
+            chunk = remainder + chunk
+            usable = len(chunk) - len(chunk) % frame_bytes
+            remainder = chunk[usable:]
+            yield np.frombuffer(chunk[:usable], dtype="<f4").reshape(-1, CHANNELS)
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}")
+
+
+def _decode(path, target):
+    """Stream decoded blocks into `target`; peak memory is one block whatever the duration."""
+    blocks = _soundfile_blocks(path) or _ffmpeg_blocks(path)
+    tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_npy_header(0))
+            frames = 0
+            for block in blocks:
+                f.write(np.ascontiguousarray(block, dtype="<f4").tobytes())
+                frames += len(block)
+            f.seek(0)
+            f.write(_npy_header(frames))
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return frames
+
+
+def _derive(canonical, target, sr, mono):
+    data = np.load(canonical, mmap_mode="r")
+    data = data.mean(axis=1) if mono else data.T
+    if sr != SAMPLE_RATE:
+        import librosa
+        data = librosa.resample(np.ascontiguousarray(data), orig_sr=SAMPLE_RATE, target_sr=sr)
+    data = np.ascontiguousarray(data if mono else data.T, dtype="float32")
+    tmp_path = f"{target}.{uuid.uuid4().hex}.tmp.npy"
+    try:
+        np.save(tmp_path, data)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _evict(keep):
+    """Drop least recently used PCM files until the cache fits its budget."""
+    try:
+        entries = [e for e in os.scandir(PCM_DIR) if e.is_file() and e.name.endswith(".npy")]
+    except FileNotFoundError:
+        return
+    entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries)
+    total = sum(size for _, size, _ in entries)
+    budget = PCM_CACHE_MAX_MB * 1024 * 1024
+    for _, size, path in entries:
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        try:
+            # Open memory maps of the file stay valid after unlink
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def ensure(path, sr=SAMPLE_RATE, mono=False):
+    """Blocking: path of the cached PCM for `path`, decoding or deriving it on first use."""
+    target = pcm_path(path, sr, mono)
+    if os.path.exists(target):
+        os.utime(target)
+        return target
+
+    with _lock_for(target):
+        if os.path.exists(target):
+            return target
+        os.makedirs(PCM_DIR, exist_ok=True)
+        if sr == SAMPLE_RATE and not mono:
+            frames = _decode(path, target)
+            print(f"[PCM] Decoded {os.path.basename(path)} ({frames / SAMPLE_RATE:.1f}s)")
+        else:
+            _derive(ensure(path), target, sr, mono)
+            print(f"[PCM] Derived {sr} Hz {'mono' if mono else 'stereo'} PCM for {os.path.basename(path)}")
+    _evict(keep=target)
+    return target
+
+
+def load(path, sr=SAMPLE_RATE, mono=False):
+    """
+    Blocking: read-only memory map of `path` as float32 PCM, [samples] when `mono`
+    else [samples, 2]. Pages are shared between every consumer of the same audio.
+    """
+    try:
+        return np.load(ensure(path, sr, mono), mmap_mode="r")
+    except FileNotFoundError:
+        # Evicted (possibly by another process) between ensure() and the open;
+        # once mapped the file can be unlinked safely, so one more try suffices
+        return np.load(ensure(path, sr, mono), mmap_mode="r")
+
+
+def duration(path):
+    return len(load(path)) / SAMPLE_RATE
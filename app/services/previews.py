@@ -0,0 +1,98 @@
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+from .transcoder import DERIVED_DIRNAME, format_extension, transcode
+
+# Multi-resolution min/max peaks, finest first; every level must be a multiple of the first
+PEAK_LEVELS = [int(x) for x in os.getenv("PREVIEW_PEAK_LEVELS", "256,1024,4096,16384").split(",")]
+PREVIEW_FORMAT = "preview"
+RENDITION_WORKERS = int(os.getenv("PREVIEW_WORKERS", "4"))
+
+BLOCK_PIXELS = 4096
+
+
+def peaks_path(source_path, samples_per_pixel):
+    base = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(os.path.dirname(source_path), DERIVED_DIRNAME, f"{base}.peaks-{samples_per_pixel}.dat")
+
+
+def _quantize(values):
+    return np.clip(np.round(values * 127), -128, 127).astype(np.int8)
+
+
+def _reduce(mins, maxs, ratio):
+    pad = (-len(mins)) % ratio
+    if pad:
+        mins = np.pad(mins, (0, pad), mode="edge")
+        maxs = np.pad(maxs, (0, pad), mode="edge")
+    return mins.reshape(-1, ratio).min(axis=1), maxs.reshape(-1, ratio).max(axis=1)
+
+
+def _write_dat(path, sample_rate, samples_per_pixel, mins, maxs):
+    """audiowaveform v1 .dat (8-bit): header, then interleaved min/max per pixel. peaks.js reads it directly."""
+    data = np.empty(len(mins) * 2, dtype=np.int8)
+    data[0::2] = _quantize(mins)
+    data[1::2] = _quantize(maxs)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<iIiiI", 1, 1, sample_rate, samples_per_pixel, len(mins)))
+        f.write(data.tobytes())
+    os.replace(tmp_path, path)
+
+
+def compute_peaks(source_path, levels=PEAK_LEVELS):
+    """Blocking: scan `source_path` once and write a .dat peak file per level. Returns {samples_per_pixel: path}."""
+    finest = levels[0]
+    mins, maxs = [], []
+    with sf.SoundFile(source_path) as source:
+        sample_rate = source.samplerate
+        for block in source.blocks(blocksize=finest * BLOCK_PIXELS, dtype="float32", always_2d=True):
+            pad = (-len(block)) % finest
+            if pad:
+                block = np.pad(block, ((0, pad), (0, 0)), mode="edge")
+            # Channels are merged: each pixel spans the extremes of every channel
+            pixels = block.reshape(-1, finest * block.shape[1])
+            mins.append(pixels.min(axis=1))
+            maxs.append(pixels.max(axis=1))
+
+    mins = np.concatenate(mins) if mins else np.zeros(0, dtype="float32")
+    maxs = np.concatenate(maxs) if maxs else np.zeros(0, dtype="float32")
+
+    paths = {}
+    for samples_per_pixel in levels:
+        path = peaks_path(source_path, samples_per_pixel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        level_mins, level_maxs = _reduce(mins, maxs, samples_per_pixel // finest) if samples_per_pixel != finest else (mins, maxs)
+        _write_dat(path, sample_rate, samples_per_pixel, level_mins, level_maxs)
+        paths[samples_per_pixel] = path
+    return paths
+
+
+def _render_stem(source_path):
+    if not os.path.exists(peaks_path(source_path, PEAK_LEVELS[-1])):
+        compute_peaks(source_path)
+    transcode(source_path, PREVIEW_FORMAT)
+
+
+def render_previews(source_paths):
+    """Blocking post-separation stage: low-bitrate preview and peak files for each stem master."""
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, RENDITION_WORKERS)) as pool:
+        futures = {path: pool.submit(_render_stem, path) for path in dict.fromkeys(source_paths)}
+    for path, future in futures.items():
+        if future.exception():
+            failures[path] = future.exception()
+            print(f"[PREVIEW] Failed to render previews for {os.path.basename(path)}: {future.exception()}")
+    return failures
+
+
+def preview_urls(stem_url):
+    """URLs of the preview renditions for a stored stem URL."""
+    directory, filename = stem_url.rsplit("/", 1)
+    base = os.path.splitext(filename)[0]
+    return {
+        "preview": f"{directory}/{DERIVED_DIRNAME}/{base}{format_extension(PREVIEW_FORMAT)}",
+        "peaks": {str(level): f"{directory}/{DERIVED_DIRNAME}/{base}.peaks-{level}.dat" for level in PEAK_LEVELS},
+    }
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from ..database import SessionLocal
+from ..models.job import Job
+from .job_events import job_events, job_snapshot
+
+PROGRESS_WRITE_INTERVAL_MS = int(os.getenv("PROGRESS_WRITE_INTERVAL_MS", "1000"))
+
+
+@contextmanager
+def stage_timer(timings, stage):
+    """Accumulate wall time spent in `stage` into the `timings` dict (seconds)."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round(timings.get(stage, 0.0) + time.perf_counter() - start, 3)
+
+
+class ProgressReporter:
+    """
+    Turns fine-grained progress from separation threads into `jobs.progress`
+    writes, at most one per PROGRESS_WRITE_INTERVAL_MS. Progress never goes backwards.
+    """
+
+    def __init__(self, job_id: int, initial=0.0, interval_ms=PROGRESS_WRITE_INTERVAL_MS):
+        self.job_id = job_id
+        self.interval = interval_ms / 1000.0
+        self.progress = initial
+        self._written = initial
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+
+    def report(self, value, force=False):
+        with self._lock:
+            if value <= self.progress and not force:
+                return
+            self.progress = max(self.progress, value)
+            now = time.monotonic()
+            if not force and now - self._last_write < self.interval:
+                return
+            if self.progress == self._written:
+                return
+            self._last_write = now
+            self._written = value = self.progress
+        self._write(value)
+
+    def flush(self):
+        self.report(self.progress, force=True)
+
+    def stage(self, start, end):
+        """Callback mapping a stage's (done, total) onto the [start, end] job progress range."""
+        def callback(done, total):
+            if total:
+                self.report(start + (end - start) * min(done / total, 1.0))
+        return callback
+
+    def _write(self, value):
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(Job.id == self.job_id, Job.status == "processing").update(
+                {Job.progress: round(value, 4)}, synchronize_session=False
+            )
+            db.commit()
+            job = db.query(Job).filter(Job.id == self.job_id).first()
+            if job:
+                job_events.publish(job_snapshot(job))
+        except Exception as e:
+            print(f"[JOB] Progress write failed for job {self.job_id}: {e}")
+        finally:
+            db.close()
@@ -0,0 +1,200 @@
+import asyncio
+import math
+import os
+from collections import OrderedDict, deque
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..models.job import Job
+from . import job_queue
+from .audio_service import process_audio_job
+
+# Concurrency is bounded by whichever runs out first: cores or memory.
+CORES_PER_JOB = max(1, int(os.getenv("WORKER_CORES_PER_JOB", "2")))
+JOB_MEMORY_MB = int(os.getenv("SCHEDULER_JOB_MEMORY_MB", "3072"))
+MAX_QUEUED_JOBS = int(os.getenv("SCHEDULER_MAX_QUEUED", "100"))
+# Applies to identified users (X-User-Id); anonymous uploads share only the global cap
+MAX_QUEUED_PER_USER = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "50"))
+DEFAULT_JOB_SECONDS = float(os.getenv("SCHEDULER_DEFAULT_JOB_SECONDS", "180"))
+
+# Lanes are served by weighted round robin: quick standard jobs aren't stuck
+# behind two-pass high-quality ones, which still get a share.
+LANE_WEIGHTS = OrderedDict([("standard", 3), ("high_quality", 1)])
+
+
+def _memory_limit_mb():
+    """Container memory limit (cgroup v2, then v1), falling back to physical memory."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value.isdigit() and int(value) < 1 << 60:
+                return int(value) // (1024 * 1024)
+        except OSError:
+            continue
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_concurrency():
+    by_cores = max(1, (os.cpu_count() or 1) // CORES_PER_JOB)
+    memory_mb = _memory_limit_mb()
+    by_memory = max(1, memory_mb // JOB_MEMORY_MB) if memory_mb else by_cores
+    return min(by_cores, by_memory)
+
+
+MAX_CONCURRENT_JOBS = int(os.getenv("SCHEDULER_MAX_CONCURRENT", "0")) or default_concurrency()
+
+
+class QueueFull(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Lane:
+    """Per-user FIFO queues served round robin, so one user's album can't starve everyone else."""
+
+    def __init__(self):
+        self.users = OrderedDict()  # user key -> deque of queued jobs
+
+    def push(self, user, item):
+        self.users.setdefault(user, deque()).append(item)
+
+    def pop(self):
+        user, jobs = next(iter(self.users.items()))
+        item = jobs.popleft()
+        # Rotate the served user to the back of the line
+        del self.users[user]
+        if jobs:
+            self.users[user] = jobs
+        return item
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.users.values())
+
+
+class JobScheduler:
+    """
+    Admission control and ordering for inline execution: at most
+    `max_concurrent` separations run at once, the rest wait in priority lanes
+    with per-user fair queuing, and new work is refused once the queue is full.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_JOBS, max_queued=MAX_QUEUED_JOBS, max_queued_per_user=MAX_QUEUED_PER_USER):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.lanes = OrderedDict((name, _Lane()) for name in LANE_WEIGHTS)
+        self.running = set()
+        self.avg_job_seconds = DEFAULT_JOB_SECONDS
+        self._credits = dict(LANE_WEIGHTS)
+        self._queued_by_user = {}
+
+    def queued(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def retry_after(self):
+        """Rough seconds until a queue slot frees up, for Retry-After."""
+        return max(1, math.ceil(self.avg_job_seconds / self.max_concurrent))
+
+    def admit(self, count=1, user_id=None):
+        """Raise QueueFull if `count` more jobs from `user_id` would not fit."""
+        if self.queued() + count > self.max_queued:
+            raise QueueFull("Separation queue is full, try again later", self.retry_after())
+        if user_id is not None and self._queued_by_user.get(user_id, 0) + count > self.max_queued_per_user:
+            raise QueueFull("Too many queued jobs for this user", self.retry_after())
+
+    def submit(self, job_id, file_path, high_quality=False, user_id=None):
+        lane = "high_quality" if high_quality else "standard"
+        self.lanes[lane].push(user_id, (job_id, file_path, high_quality, user_id))
+        self._queued_by_user[user_id] = self._queued_by_user.get(user_id, 0) + 1
+        self._dispatch()
+
+    def _next_lane(self, lanes, credits):
+        """Weighted round robin over non-empty lanes, refilling credits when every lane has spent its share."""
+        ready = [name for name in lanes if len(lanes[name])]
+        if not ready:
+            return None
+        if not any(credits[name] > 0 for name in ready):
+            credits.update(LANE_WEIGHTS)
+        for name in ready:
+            if credits[name] > 0:
+                credits[name] -= 1
+                return name
+
+    def _dispatch(self):
+        while len(self.running) < self.max_concurrent:
+            lane = self._next_lane(self.lanes, self._credits)
+            if lane is None:
+                return
+            job_id, file_path, high_quality, user_id = self.lanes[lane].pop()
+            self._queued_by_user[user_id] -= 1
+            if not self._queued_by_user[user_id]:
+                del self._queued_by_user[user_id]
+            task = asyncio.get_running_loop().create_task(self._run(job_id, file_path, high_quality))
+            self.running.add(task)
+
+    async def _run(self, job_id, file_path, high_quality):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            await process_audio_job(job_id, file_path, high_quality)
+        finally:
+            self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * (loop.time() - start)
+            self.running.discard(asyncio.current_task())
+            self._dispatch()
+
+    def position(self, job_id):
+        """1-based place in the dispatch order, or None if the job isn't queued here."""
+        lanes = OrderedDict()
+        for name, lane in self.lanes.items():
+            copy = _Lane()
+            copy.users = OrderedDict((user, deque(jobs)) for user, jobs in lane.users.items())
+            lanes[name] = copy
+        credits = dict(self._credits)
+        position = 0
+        while True:
+            lane = self._next_lane(lanes, credits)
+            if lane is None:
+                return None
+            position += 1
+            if lanes[lane].pop()[0] == job_id:
+                return position
+
+    def stats(self):
+        return {
+            "running": len(self.running),
+            "queued": self.queued(),
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+        }
+
+
+job_scheduler = JobScheduler()
+
+
+# In worker mode the pending rows are the queue, so admission and position come from the database.
+
+async def check_admission(db: AsyncSession, count=1, user_id=None):
+    """Raise QueueFull when `count` more jobs from `user_id` should be refused."""
+    if job_queue.EXECUTION_MODE == "inline":
+        job_scheduler.admit(count, user_id)
+        return
+    pending = await db.scalar(select(func.count()).select_from(Job).where(Job.status == "pending"))
+    if pending + count > MAX_QUEUED_JOBS:
+        raise QueueFull("Separation queue is full, try again later", max(1, math.ceil(DEFAULT_JOB_SECONDS)))
+    if user_id is None:
+        return
+    mine = await db.scalar(select(func.count()).select_from(Job).where(Job.status == "pending", Job.user_id == user_id))
+    if mine + count > MAX_QUEUED_PER_USER:
+        raise QueueFull("Too many queued jobs for this user", max(1, math.ceil(DEFAULT_JOB_SECONDS)))
+
+
+async def queue_position(db: AsyncSession, job_id):
+    if job_queue.EXECUTION_MODE == "inline":
+        return job_scheduler.position(job_id)
+    # Workers claim in id order
+    ahead = await db.scalar(select(func.count()).select_from(Job).where(Job.status == "pending", Job.id < job_id))
+    return ahead + 1
@@ -0,0 +1,227 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import soundfile as sf
+from .model_pool import model_pool, timed_separate
+from .metrics import start_snapshot_writer
+from .progress import stage_timer
+from . import pcm_store
+
+# Tracks longer than the threshold are separated window by window so peak
+# memory stays roughly constant regardless of duration. 0 disables segmenting.
+SEGMENT_THRESHOLD_SECONDS = float(os.getenv("SEPARATION_SEGMENT_THRESHOLD_SECONDS", "300"))
+SEGMENT_SECONDS = float(os.getenv("SEPARATION_SEGMENT_SECONDS", "60"))
+OVERLAP_SECONDS = float(os.getenv("SEPARATION_OVERLAP_SECONDS", "2"))
+SEGMENT_WORKERS = int(os.getenv("SEPARATION_SEGMENT_WORKERS", "1"))
+SAMPLE_RATE = pcm_store.SAMPLE_RATE
+
+_STEM_NAME = re.compile(r"^seg_\d+(_\(.+\)_.+)$")
+_executor = None
+
+# Processing seconds per second of audio, learned per model, for estimating
+# progress of single-pass separations that report nothing until they finish
+DEFAULT_REALTIME_FACTOR = float(os.getenv("SEPARATION_REALTIME_FACTOR", "1.0"))
+_realtime_factors = {}
+
+
+def audio_duration(file_path):
+    """Seconds of audio, from the decoded PCM every later stage reads anyway."""
+    return pcm_store.duration(file_path)
+
+
+def should_segment(file_path):
+    return SEGMENT_THRESHOLD_SECONDS > 0 and audio_duration(file_path) > SEGMENT_THRESHOLD_SECONDS
+
+
+def _separate_segment(model_name, output_dir, segment_path):
+    """Returns (output filenames, stage timings); runs in this process or a pool child."""
+    timings = {}
+    with model_pool.lease(model_name, output_dir, timings) as separator:
+        # Per-window peak normalisation would make the gain jump between windows;
+        # only scale down when a window would actually clip.
+        instance = separator.model_instance
+        original_threshold = instance.normalization_threshold
+        instance.normalization_threshold = 1.0
+        try:
+            return [os.path.basename(f) for f in timed_separate(separator, segment_path, timings, model_name)], timings
+        finally:
+            instance.normalization_threshold = original_threshold
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Long-lived so each child keeps its own warm model pool between jobs
+        _executor = ProcessPoolExecutor(
+            max_workers=SEGMENT_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=start_snapshot_writer
+        )
+    return _executor
+
+
+class _StemWriter:
+    """Overlap-adds consecutive windows of one stem into its output file."""
+
+    def __init__(self, path, channels):
+        self.file = sf.SoundFile(path, "w", samplerate=SAMPLE_RATE, channels=channels, subtype="PCM_16")
+        self.channels = channels
+        self.tail = None
+        self.written = 0
+
+    def pad_to(self, position):
+        # A stem that was silent (not written) in earlier windows
+        if position > self.written:
+            self.file.write(np.zeros((position - self.written, self.channels), dtype="float32"))
+            self.written = position
+
+    def add(self, data, overlap, is_last):
+        if self.tail is not None:
+            n = min(overlap, len(data), len(self.tail))
+            fade_in = np.linspace(0.0, 1.0, n, dtype="float32")[:, None]
+            data = data.copy()
+            data[:n] = data[:n] * fade_in + self.tail[:n] * (1.0 - fade_in)
+        end = len(data) if is_last else max(len(data) - overlap, 0)
+        self.file.write(data[:end])
+        self.written += end
+        self.tail = None if is_last else data[end:]
+
+    def close(self):
+        self.file.close()
+
+
+def separate_segmented(model_name, output_dir, file_path, progress=None, timings=None):
+    """
+    Separate `file_path` in overlapping windows, crossfading each stem's windows
+    straight into its output file. Returns stem filenames like `Separator.separate`.
+    `progress(done, total)` is called after each window is written.
+    """
+    timings = {} if timings is None else timings
+    os.makedirs(output_dir, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(prefix="forge-segments-")
+    writers = {}
+    try:
+        with stage_timer(timings, "decode"):
+            source = pcm_store.load(file_path)
+        base = os.path.splitext(os.path.basename(file_path))[0]
+
+        total = len(source)
+        window = int(SEGMENT_SECONDS * SAMPLE_RATE)
+        overlap = int(OVERLAP_SECONDS * SAMPLE_RATE)
+        hop = window - overlap
+        starts = list(range(0, max(total - overlap, 1), hop))
+        print(f"[SEGMENT] {file_path}: {len(starts)} windows of {SEGMENT_SECONDS}s ({OVERLAP_SECONDS}s overlap)")
+
+        def write_segment(index):
+            with stage_timer(timings, "decode"):
+                data = source[starts[index]:starts[index] + window]
+                path = os.path.join(scratch_dir, f"seg_{index:04d}.wav")
+                sf.write(path, data, SAMPLE_RATE, subtype="FLOAT")
+                return path, len(data)
+
+        segment_out_dir = os.path.join(scratch_dir, "out")
+        os.makedirs(segment_out_dir, exist_ok=True)
+        executor = _get_executor() if SEGMENT_WORKERS > 1 else None
+        # Keep a bounded number of windows queued ahead so scratch disk use stays flat too
+        ahead = SEGMENT_WORKERS * 2 if executor else 1
+        in_flight = []
+        next_index = 0
+
+        for index in range(len(starts)):
+            while next_index < len(starts) and len(in_flight) < ahead:
+                path, length = write_segment(next_index)
+                pending = executor.submit(_separate_segment, model_name, segment_out_dir, path) if executor else None
+                in_flight.append((path, length, pending))
+                next_index += 1
+
+            path, length, pending = in_flight.pop(0)
+            outputs, segment_timings = pending.result() if pending else _separate_segment(model_name, segment_out_dir, path)
+            os.remove(path)
+            for stage, seconds in segment_timings.items():
+                timings[stage] = round(timings.get(stage, 0.0) + seconds, 3)
+
+            is_last = index == len(starts) - 1
+            with stage_timer(timings, "write"):
+                seen = set()
+                for name in outputs:
+                    match = _STEM_NAME.match(name)
+                    if not match:
+                        continue
+                    out_name = f"{base}{match.group(1)}"
+                    stem_path = os.path.join(segment_out_dir, name)
+                    data, _ = sf.read(stem_path, dtype="float32", always_2d=True)
+                    os.remove(stem_path)
+                    writer = writers.get(out_name)
+                    if writer is None:
+                        writer = writers[out_name] = _StemWriter(os.path.join(output_dir, out_name), data.shape[1])
+                        writer.pad_to(starts[index])
+                    writer.add(data, overlap, is_last)
+                    seen.add(out_name)
+
+                for out_name, writer in writers.items():
+                    if out_name not in seen:
+                        writer.add(np.zeros((length, writer.channels), dtype="float32"), overlap, is_last)
+
+            if progress:
+                progress(index + 1, len(starts))
+
+        return list(writers)
+    finally:
+        for writer in writers.values():
+            writer.close()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _separate_with_estimate(model_name, file_path, progress, run):
+    """Single-pass separation via `run()`, ticking estimated progress from the learned realtime factor."""
+    duration = audio_duration(file_path)
+    expected = max(duration * _realtime_factors.get(model_name, DEFAULT_REALTIME_FACTOR), 1.0)
+    stop = threading.Event()
+    start = time.monotonic()
+
+    def tick():
+        while not stop.wait(0.5):
+            # Hold short of the end until the separator actually returns
+            progress(min(time.monotonic() - start, expected * 0.95), expected)
+
+    ticker = threading.Thread(target=tick, daemon=True)
+    ticker.start()
+    try:
+        output_files = run()
+    finally:
+        stop.set()
+        ticker.join()
+
+    if duration > 0:
+        factor = (time.monotonic() - start) / duration
+        previous = _realtime_factors.get(model_name)
+        _realtime_factors[model_name] = factor if previous is None else 0.7 * previous + 0.3 * factor
+    return output_files
+
+
+def separate_file(model_name, output_dir, file_path, progress=None, timings=None, on_stem=None):
+    """
+    Blocking entry point: segmented separation for long tracks, a single pass otherwise.
+    Either way the separator reads the file's shared decoded PCM rather than decoding it again.
+    `on_stem(stem_name, source)` is called with each stem's array in single-pass mode only;
+    segmented runs assemble stems on disk.
+    """
+    with stage_timer(timings, "decode"):
+        pcm_store.ensure(file_path)
+    if should_segment(file_path):
+        return separate_segmented(model_name, output_dir, file_path, progress=progress, timings=timings)
+    # Copied out of the page cache: the separator may normalise its input in place
+    mix = np.array(pcm_store.load(file_path))
+    return separate_array(model_name, output_dir, mix, file_path, progress, timings, on_stem)
+
+
+def separate_array(model_name, output_dir, mix, label_path, progress=None, timings=None, on_stem=None):
+    """Blocking: single-pass separation of an in-memory [samples, channels] array (see ModelPool.separate_array)."""
+    run = lambda: model_pool.separate_array(model_name, output_dir, mix, label_path, timings, on_stem)
+    if progress:
+        return _separate_with_estimate(model_name, label_path, progress, run)
+    return run()
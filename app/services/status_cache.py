@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# "memory" caches per process; "redis" shares one cache across API instances and workers
+STATUS_CACHE_BACKEND = os.getenv("JOB_STATUS_CACHE_BACKEND", "memory")
+STATUS_CACHE_REDIS_URL = os.getenv("JOB_STATUS_CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Bounds staleness of in-flight jobs whose updates this process might not see
+STATUS_CACHE_TTL_SECONDS = float(os.getenv("JOB_STATUS_CACHE_TTL_SECONDS", "2"))
+# Terminal states rarely change, but can (a retry, stems expiring): cache them long, not forever
+STATUS_CACHE_TERMINAL_TTL_SECONDS = float(os.getenv("JOB_STATUS_CACHE_TERMINAL_TTL_SECONDS", "300"))
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("JOB_STATUS_CACHE_MAX_ENTRIES", "10000"))
+
+# "expired": completed, but the lifecycle collector has since deleted the stems
+TERMINAL_STATUSES = {"completed", "failed", "expired"}
+
+
+class MemoryStatusBackend:
+    # Dict lookups under a lock: cheap enough to call straight from the event loop
+    blocking = False
+
+    def __init__(self, max_entries=STATUS_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            item = self._entries.get(job_id)
+            if item is None:
+                return None
+            snapshot, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._entries[job_id]
+                return None
+            self._entries.move_to_end(job_id)
+            return snapshot
+
+    def get_many(self, job_ids):
+        return {job_id: snapshot for job_id in job_ids if (snapshot := self.get(job_id)) is not None}
+
+    def set(self, job_id, snapshot, ttl):
+        with self._lock:
+            self._entries[job_id] = (snapshot, None if ttl is None else time.monotonic() + ttl)
+            self._entries.move_to_end(job_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+
+class RedisStatusBackend:
+    PREFIX = "forge:job-status:"
+    # Network round trips: JobStatusCache keeps these off the event loop
+    blocking = True
+
+    def __init__(self, url=STATUS_CACHE_REDIS_URL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("JOB_STATUS_CACHE_BACKEND=redis requires the `redis` package") from e
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, job_id):
+        raw = self.client.get(f"{self.PREFIX}{job_id}")
+        return json.loads(raw) if raw else None
+
+    def get_many(self, job_ids):
+        if not job_ids:
+            return {}
+        raws = self.client.mget([f"{self.PREFIX}{job_id}" for job_id in job_ids])
+        return {job_id: json.loads(raw) for job_id, raw in zip(job_ids, raws) if raw}
+
+    def set(self, job_id, snapshot, ttl):
+        # Terminal snapshots still expire eventually so Redis isn't an unbounded archive
+        self.client.set(f"{self.PREFIX}{job_id}", json.dumps(snapshot), ex=max(int(ttl), 1) if ttl else 7 * 24 * 3600)
+
+    def delete(self, job_id):
+        self.client.delete(f"{self.PREFIX}{job_id}")
+
+
+class JobStatusCache:
+    """
+    Read-through cache of job status snapshots for the polling endpoint.
+
+    Every published job event refreshes the entry (see JobEventBroker), so the
+    TTLs only matter for updates this process never hears about. Terminal
+    snapshots get a longer one, still finite so a missed transition heals.
+    Async callers use the `a*` methods, which run a blocking backend in a
+    thread; `put_nowait` hands event writes to a single thread so they land in order.
+    """
+
+    def __init__(self, backend=STATUS_CACHE_BACKEND, ttl=STATUS_CACHE_TTL_SECONDS, terminal_ttl=STATUS_CACHE_TERMINAL_TTL_SECONDS):
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self.backend = RedisStatusBackend() if backend == "redis" else MemoryStatusBackend()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="status-cache") if self.backend.blocking else None
+
+    def get(self, job_id):
+        try:
+            return self.backend.get(job_id)
+        except Exception as e:
+            print(f"[STATUS] Cache read failed for job {job_id}: {e}")
+            return None
+
+    def get_many(self, job_ids):
+        """{job id: snapshot} for the cached ones among `job_ids`."""
+        try:
+            return self.backend.get_many(list(job_ids))
+        except Exception as e:
+            print(f"[STATUS] Cache read failed for jobs {list(job_ids)}: {e}")
+            return {}
+
+    async def aget(self, job_id):
+        return await asyncio.to_thread(self.get, job_id) if self.backend.blocking else self.get(job_id)
+
+    async def aget_many(self, job_ids):
+        return await asyncio.to_thread(self.get_many, job_ids) if self.backend.blocking else self.get_many(job_ids)
+
+    async def aput(self, snapshot):
+        if self.backend.blocking:
+            await asyncio.to_thread(self.put, snapshot)
+        else:
+            self.put(snapshot)
+
+    def put_nowait(self, snapshot):
+        """Never blocks the caller, which may be the event loop publishing a job event."""
+        if self._writer is not None:
+            self._writer.submit(self.put, snapshot)
+        else:
+            self.put(snapshot)
+
+    def put(self, snapshot):
+        ttl = self.terminal_ttl if snapshot.get("status") in TERMINAL_STATUSES else self.ttl
+        try:
+            self.backend.set(snapshot["id"], snapshot, ttl)
+        except Exception as e:
+            print(f"[STATUS] Cache write failed for job {snapshot.get('id')}: {e}")
+
+    def invalidate(self, job_id):
+        try:
+            self.backend.delete(job_id)
+        except Exception as e:
+            print(f"[STATUS] Cache invalidation failed for job {job_id}: {e}")
+
+
+job_status_cache = JobStatusCache()
@@ -0,0 +1,158 @@
+import os
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from ..models.job import Job
+from ..models.stem_cache import StemCacheEntry
+from .storage import storage, STEMS_DIR
+
+CACHE_MAX_BYTES = int(os.getenv("STEM_CACHE_MAX_MB", "20480")) * 1024 * 1024
+
+
+def make_key(audio_hash: str, model_names, high_quality: bool):
+    return f"{audio_hash}:{'+'.join(model_names)}:{'hq' if high_quality else 'std'}"
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class StemCache:
+    """
+    Maps (audio hash, models, quality) to a finished stem set so duplicate uploads
+    complete by pointing at the existing files instead of re-running separation.
+
+    `ref_count` counts jobs whose stems live in an entry's directory, the owner
+    included. An entry's directory is deleted once the last referencing job has
+    been released; going over the budget expires those jobs to get there.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+    def lookup(self, db: Session, cache_key: str):
+        entry = db.query(StemCacheEntry).filter(
+            StemCacheEntry.cache_key == cache_key,
+            StemCacheEntry.evicted == False,  # noqa: E712
+        ).first()
+        if entry and not os.path.isdir(entry.stems_dir):
+            # Files vanished underneath us; stop advertising them
+            entry.evicted = True
+            db.commit()
+            return None
+        return entry
+
+    def attach(self, db: Session, job: Job, cache_key: str):
+        """Point `job` at a cached stem set. Returns True on a hit; the caller commits."""
+        entry = self.lookup(db, cache_key)
+        if not entry:
+            return False
+        db.query(StemCacheEntry).filter(StemCacheEntry.cache_key == cache_key).update(
+            {
+                StemCacheEntry.ref_count: StemCacheEntry.ref_count + 1,
+                StemCacheEntry.last_used_at: datetime.now(timezone.utc),
+            },
+            synchronize_session=False,
+        )
+        job.stems = dict(entry.stems)
+        job.cache_key = cache_key
+        print(f"[CACHE] Job {job.id} served from cache entry of job {entry.source_job_id}")
+        return True
+
+    def store(self, db: Session, job: Job, cache_key: str, stems_dir: str):
+        """Register a freshly separated job's output as the cached result for `cache_key`."""
+        existing = db.query(StemCacheEntry).filter(StemCacheEntry.cache_key == cache_key).first()
+        if existing and not existing.evicted:
+            # Another job finished the same input first; keep this job's files private
+            return
+        if existing:
+            if existing.ref_count > 0:
+                return
+            db.delete(existing)
+            db.flush()
+
+        entry = StemCacheEntry(
+            cache_key=cache_key,
+            audio_hash=job.audio_hash,
+            models=cache_key.split(":")[1],
+            high_quality=bool(job.high_quality),
+            source_job_id=job.id,
+            stems=dict(job.stems or {}),
+            stems_dir=stems_dir,
+            size_bytes=_dir_size(stems_dir),
+            ref_count=1,
+        )
+        db.add(entry)
+        job.cache_key = cache_key
+        db.commit()
+        self.enforce_budget(db)
+
+    def release(self, db: Session, cache_key: str):
+        """Drop one job's reference, removing the files if the entry was already evicted."""
+        db.query(StemCacheEntry).filter(StemCacheEntry.cache_key == cache_key).update(
+            {StemCacheEntry.ref_count: StemCacheEntry.ref_count - 1}, synchronize_session=False
+        )
+        db.commit()
+        entry = db.query(StemCacheEntry).filter(StemCacheEntry.cache_key == cache_key).first()
+        if entry and entry.evicted and entry.ref_count <= 0:
+            self._purge(db, entry)
+
+    def expire(self, db: Session, entry: StemCacheEntry, jobs):
+        """
+        The entry's directory is going away together with `jobs`, every job pointing
+        into it (lifecycle GC): evict the entry and release each job's reference, so
+        the last release purges it. Counts that drifted above the jobs actually
+        holding the entry would pin the row forever, so it is purged regardless.
+        """
+        entry.evicted = True
+        db.commit()
+        cache_key = entry.cache_key
+        for job in jobs:
+            if job.cache_key == cache_key:
+                self.release(db, cache_key)
+        leftover = db.query(StemCacheEntry).filter(StemCacheEntry.cache_key == cache_key).first()
+        if leftover:
+            print(f"[CACHE] Purging {cache_key} with {leftover.ref_count} unaccounted refs")
+            self._purge(db, leftover)
+
+    def enforce_budget(self, db: Session):
+        """
+        Evict least recently used entries until the live ones fit in `max_bytes`.
+        The directory is its jobs' stems too, so they are expired with it (see
+        lifecycle.expire_stem_dir); while one of them is still running the entry
+        only stops serving hits, and the last release deletes it.
+        """
+        # lifecycle imports this module
+        from .lifecycle import lifecycle_collector
+
+        live = (
+            db.query(StemCacheEntry)
+            .filter(StemCacheEntry.evicted == False)  # noqa: E712
+            .order_by(StemCacheEntry.last_used_at)
+            .all()
+        )
+        total = sum(e.size_bytes or 0 for e in live)
+        for entry in live:
+            if total <= self.max_bytes:
+                break
+            print(f"[CACHE] Evicting {entry.cache_key} ({entry.size_bytes} bytes, {entry.ref_count} refs)")
+            total -= entry.size_bytes or 0
+            if not lifecycle_collector.expire_stem_dir(db, entry.stems_dir):
+                entry.evicted = True
+                db.commit()
+
+    def _purge(self, db: Session, entry: StemCacheEntry):
+        # Only ever delete directories we own under the stems root
+        if os.path.abspath(entry.stems_dir).startswith(os.path.abspath(STEMS_DIR) + os.sep):
+            storage.remove(entry.stems_dir)
+        db.delete(entry)
+        db.commit()
+
+
+stem_cache = StemCache()
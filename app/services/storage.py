@@ -0,0 +1,305 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+# Every file the service keeps lives under STORAGE_ROOT in a fixed layout:
+#   uploads/<id><ext>            accepted uploads (separation inputs)
+#   uploads/partial/             resumable upload sessions
+#   stems/<job id>/              one directory per separated job, renditions in derived/
+#   pcm/                         decoded PCM cache (see services.pcm_store)
+#   .metrics/                    metric snapshots of worker processes (see services.metrics)
+STORAGE_ROOT = os.path.abspath(os.getenv("STORAGE_ROOT") or os.path.join(tempfile.gettempdir(), "forge_audio"))
+UPLOADS_DIR = os.path.join(STORAGE_ROOT, "uploads")
+PARTIAL_DIR = os.path.join(UPLOADS_DIR, "partial")
+STEMS_DIR = os.path.join(STORAGE_ROOT, "stems")
+PCM_DIR = os.path.join(STORAGE_ROOT, "pcm")
+ACCESS_DIR = os.path.join(STORAGE_ROOT, ".access")
+METRICS_DIR = os.path.join(STORAGE_ROOT, ".metrics")
+
+# "local" keeps everything on this disk; "s3" makes an S3-compatible bucket the
+# durable copy and treats local disk as a working set that can be refetched
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET", "")
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "forge-audio")
+STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL")
+
+# Local disk quota across the whole layout; 0 disables it
+STORAGE_QUOTA_MB = int(os.getenv("STORAGE_QUOTA_MB", "51200"))
+USAGE_REFRESH_SECONDS = 30
+# Access times are recorded at most this often per stem directory
+ACCESS_RESOLUTION_SECONDS = 300
+
+
+class StorageFull(Exception):
+    pass
+
+
+class LocalBackend:
+    """
+    Objects are plain files under `root`. As the default backend its root is the
+    working directory itself and publishing is a no-op; pointed at another
+    directory it stands in for a bucket.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.strip("/").split("/"))
+
+    def put(self, key, local_path):
+        target = self._path(key)
+        if target == os.path.abspath(local_path):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        try:
+            shutil.copyfile(local_path, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, key, local_path):
+        source = self._path(key)
+        if not os.path.isfile(source):
+            return False
+        if source != os.path.abspath(local_path):
+            shutil.copyfile(source, local_path)
+        return True
+
+    def delete(self, key):
+        path = self._path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+class S3Backend:
+    """S3-compatible bucket (AWS, MinIO, R2, ...); `endpoint_url` selects a non-AWS service such as a local MinIO."""
+
+    def __init__(self, bucket=STORAGE_S3_BUCKET, prefix=STORAGE_S3_PREFIX, endpoint_url=STORAGE_S3_ENDPOINT_URL):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the `boto3` package") from e
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires STORAGE_S3_BUCKET")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key):
+        key = key.strip("/")
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, local_path):
+        self.client.upload_file(local_path, self.bucket, self._key(key))
+
+    def get(self, key, local_path):
+        from botocore.exceptions import ClientError
+        tmp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            self.client.download_file(self.bucket, self._key(key), tmp_path)
+            os.replace(tmp_path, local_path)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, key):
+        # The object itself, or everything under it when it names a directory
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(key) + "/"):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects})
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Storage:
+    """
+    Single owner of on-disk paths: the directory layout, syncing files with the
+    configured backend, per-directory access times for LRU, and the disk quota.
+    Deleting old data is the lifecycle collector's job (services.lifecycle).
+    """
+
+    def __init__(self, root=STORAGE_ROOT, backend=None, quota_mb=STORAGE_QUOTA_MB):
+        self.root = os.path.abspath(root)
+        self.backend = backend or LocalBackend(self.root)
+        self.quota_bytes = quota_mb * 1024 * 1024
+        self._usage = None
+        self._usage_at = 0.0
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    @property
+    def remote(self):
+        """True when the backend holds its own copy, so local files can be dropped and refetched."""
+        return not (isinstance(self.backend, LocalBackend) and self.backend.root == self.root)
+
+    # Layout
+
+    def ensure_layout(self):
+        for path in (UPLOADS_DIR, PARTIAL_DIR, STEMS_DIR, PCM_DIR, ACCESS_DIR):
+            os.makedirs(path, exist_ok=True)
+
+    def upload_path(self, filename):
+        return os.path.join(UPLOADS_DIR, filename)
+
+    def job_dir(self, job_id):
+        return os.path.join(STEMS_DIR, str(job_id))
+
+    def resolve(self, relative, base=None):
+        """Absolute path of `relative` under `base` (the root by default), or None if it escapes it."""
+        base = os.path.realpath(base or self.root)
+        path = os.path.realpath(os.path.join(base, relative.lstrip("/")))
+        if os.path.commonpath([path, base]) != base:
+            return None
+        return path
+
+    def key(self, path):
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        if relative.startswith(".."):
+            raise ValueError(f"{path} is outside storage")
+        return relative.replace(os.sep, "/")
+
+    # Backend sync (no-ops for the local backend)
+
+    def publish(self, path):
+        if self.remote:
+            self.backend.put(self.key(path), path)
+
+    def publish_dir(self, path):
+        """Publish a job directory's masters; renditions under derived/ are rebuilt on demand instead."""
+        if not self.remote:
+            return
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                self.publish(file_path)
+
+    def localize(self, path):
+        """Blocking: make sure `path` exists locally, fetching it from the backend if needed."""
+        if os.path.exists(path):
+            return True
+        if not self.remote:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fetched = self.backend.get(self.key(path), path)
+        if fetched:
+            print(f"[STORAGE] Fetched {self.key(path)} from backend")
+            self.add_usage(os.path.getsize(path))
+        return fetched
+
+    def remove(self, path):
+        """Delete a file or directory everywhere: local disk and the backend."""
+        self.evict_local(path)
+        if self.remote:
+            self.backend.delete(self.key(path))
+        self._forget_access(path)
+
+    def evict_local(self, path):
+        """Delete only the local copy of `path`."""
+        size = _tree_size(path) if os.path.isdir(path) else (os.path.getsize(path) if os.path.exists(path) else 0)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        self.add_usage(-size)
+
+    # Access tracking: marker files under .access/ so every process sees the same LRU order
+
+    def _marker(self, path):
+        parts = self.key(path).split("/")
+        return os.path.join(ACCESS_DIR, "__".join(parts[:2]))
+
+    def touch(self, path):
+        """Record a read of `path` against its top-level directory (e.g. stems/<job id>)."""
+        try:
+            marker = self._marker(path)
+        except ValueError:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(marker, 0.0) < ACCESS_RESOLUTION_SECONDS:
+                return
+            self._touched[marker] = now
+        try:
+            os.makedirs(ACCESS_DIR, exist_ok=True)
+            with open(marker, "a"):
+                pass
+            os.utime(marker, (now, now))
+        except OSError as e:
+            print(f"[STORAGE] Failed to record access for {path}: {e}")
+
+    def last_access(self, path):
+        for candidate in (self._marker(path), path):
+            try:
+                return os.path.getmtime(candidate)
+            except OSError:
+                continue
+        return 0.0
+
+    def _forget_access(self, path):
+        try:
+            marker = self._marker(path)
+        except ValueError:
+            return
+        if self.key(path).count("/") <= 1 and os.path.exists(marker):
+            os.remove(marker)
+        with self._lock:
+            self._touched.pop(marker, None)
+
+    # Quota
+
+    def usage(self, refresh=False):
+        """Bytes used under the root; walked at most every USAGE_REFRESH_SECONDS and adjusted in between."""
+        with self._lock:
+            stale = self._usage is None or time.monotonic() - self._usage_at > USAGE_REFRESH_SECONDS
+        if refresh or stale:
+            total = _tree_size(self.root)
+            with self._lock:
+                self._usage = total
+                self._usage_at = time.monotonic()
+        return self._usage
+
+    def add_usage(self, size):
+        with self._lock:
+            if self._usage is not None:
+                self._usage = max(self._usage + size, 0)
+
+    def check_quota(self, incoming=0):
+        """Raise StorageFull if writing `incoming` more bytes would exceed the quota."""
+        if self.quota_bytes and self.usage() + incoming > self.quota_bytes:
+            raise StorageFull("Storage quota exceeded")
+
+
+def _make_backend():
+    if STORAGE_BACKEND == "s3":
+        return S3Backend()
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'")
+    return LocalBackend(STORAGE_ROOT)
+
+
+storage = Storage(backend=_make_backend())
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import threading
+import uuid
+
+# Derived renditions are written next to their master under this directory,
+# so they are shared by every job referencing the stems and removed with them.
+DERIVED_DIRNAME = "derived"
+
+# format -> (extension, ffmpeg codec arguments) for what downloads and exports accept
+FORMATS = {
+    "wav": (".wav", ["-c:a", "pcm_s16le"]),
+    "flac": (".flac", ["-c:a", "flac", "-compression_level", "5"]),
+    "opus": (".ogg", ["-c:a", "libopus", "-b:a", os.getenv("TRANSCODE_OPUS_BITRATE", "160k")]),
+    "mp3": (".mp3", ["-c:a", "libmp3lame", "-b:a", os.getenv("TRANSCODE_MP3_BITRATE", "320k")]),
+}
+FORMAT_ALIASES = {"ogg": "opus"}
+# Renditions the service makes for itself, never offered as a download format
+INTERNAL_FORMATS = {
+    # Low-bitrate rendition for instant dashboard playback (see services.previews)
+    "preview": (".preview.ogg", ["-c:a", "libopus", "-b:a", os.getenv("PREVIEW_BITRATE", "48k")]),
+}
+RENDITIONS = {**FORMATS, **INTERNAL_FORMATS}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def normalize_format(fmt):
+    """Canonical format name for a `format` query value, or None if unsupported."""
+    if not fmt:
+        return None
+    fmt = fmt.strip().lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    return fmt if fmt in FORMATS else None
+
+
+def format_extension(fmt):
+    return RENDITIONS[fmt][0]
+
+
+def derived_path(source_path, fmt):
+    base = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(os.path.dirname(source_path), DERIVED_DIRNAME, f"{base}{format_extension(fmt)}")
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def _drop_lock(path, lock):
+    # Only needed while the rendition is being made; later callers find the file
+    with _locks_guard:
+        if _locks.get(path) is lock:
+            del _locks[path]
+
+
+def transcode(source_path, fmt):
+    """
+    Blocking: return a path to `source_path` in `fmt`, transcoding with ffmpeg on
+    first use. The master itself is returned when it is already in that format.
+    """
+    if os.path.splitext(source_path)[1].lower() == format_extension(fmt):
+        return source_path
+
+    target = derived_path(source_path, fmt)
+    if os.path.exists(target):
+        return target
+
+    # One transcode per rendition even when several requests ask at once
+    lock = _lock_for(target)
+    try:
+        with lock:
+            if os.path.exists(target):
+                return target
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.{uuid.uuid4().hex}.tmp{format_extension(fmt)}"
+            try:
+                subprocess.run(
+                    ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source_path, "-vn", *RENDITIONS[fmt][1], tmp_path],
+                    check=True, capture_output=True,
+                )
+                # Rename into place so readers never see a partial file
+                os.replace(tmp_path, target)
+            except (subprocess.CalledProcessError, OSError) as e:
+                stderr = (getattr(e, "stderr", None) or b"").decode(errors="replace").strip()
+                print(f"[TRANSCODE] {os.path.basename(source_path)} -> {fmt} failed: {stderr or e}")
+                raise TranscodeError(f"Could not convert {os.path.basename(source_path)} to {fmt}") from e
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    finally:
+        _drop_lock(target, lock)
+    print(f"[TRANSCODE] {os.path.basename(source_path)} -> {fmt}")
+    return target
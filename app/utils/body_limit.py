@@ -0,0 +1,43 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+class BodySizeLimitMiddleware:
+    """
+    Caps request bodies of selected routes while they arrive. A declared
+    Content-Length over the limit is refused before anything is read, and a
+    body that turns out larger is cut off mid-stream. Handlers taking
+    `File(...)` only run once Starlette has spooled the whole multipart body,
+    which is too late to protect the network or the spool disk.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        # {(method, path): max body bytes}
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body too large. Maximum is {limit // (1024 * 1024)}MB"
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised into the body parser; FastAPI passes HTTPExceptions through as responses
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
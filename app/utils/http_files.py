@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+import aiofiles
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+# Stem files never change once written (new results get new paths), so
+# browsers and CDNs may keep them for a year without revalidating.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 256 * 1024
+
+AUDIO_MEDIA_TYPES = {
+    ".wav": "audio/wav",
+    ".mp3": "audio/mpeg",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+    ".opus": "audio/ogg",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+}
+
+# (path, size, mtime_ns) -> etag; hashing a stem once per process is enough
+_ETAG_CACHE_SIZE = 4096
+_etags = OrderedDict()
+_etags_lock = threading.Lock()
+
+
+def content_disposition(filename):
+    """
+    Attachment header for any filename. Headers go out as latin-1, so non-ASCII
+    names get an ASCII fallback plus the RFC 5987 `filename*` form browsers prefer.
+    """
+    fallback = "".join(c if 32 <= ord(c) < 127 and c not in '"\\' else "_" for c in filename)
+    header = f'attachment; filename="{fallback}"'
+    if fallback != filename:
+        header += f"; filename*=utf-8''{quote(filename, safe='')}"
+    return header
+
+
+def media_type_for(path):
+    ext = os.path.splitext(path)[1].lower()
+    return AUDIO_MEDIA_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def _hash_etag(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return f'"{hasher.hexdigest()[:32]}"'
+
+
+async def content_etag(path, stat=None):
+    """Strong ETag derived from the file's bytes, memoised per (path, size, mtime)."""
+    stat = stat or os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag:
+            _etags.move_to_end(key)
+            return etag
+    etag = await asyncio.to_thread(_hash_etag, path)
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > _ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
+
+
+def etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    # Weak comparison for If-None-Match: W/"x" matches "x"
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag in tags
+
+
+def _not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_range(header, size):
+    """
+    Parse a single `bytes=` range against `size`. Returns (start, end) inclusive,
+    None when the header should be ignored (serve the whole file), or raises
+    ValueError when the range is unsatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Multipart ranges aren't worth it for audio; a full 200 is allowed by the spec
+        return None
+    first, sep, last = spec.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("range not satisfiable")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+def _if_range_current(if_range, etag, mtime):
+    """If-Range: honour the range only when the client's copy is still the current one."""
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag
+    return _not_modified_since(if_range, mtime)
+
+
+async def _file_chunks(path, start, length):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def file_response(request: Request, path, media_type=None, filename=None, cache_control=IMMUTABLE_CACHE_CONTROL):
+    """
+    Serve `path` with a content ETag, Last-Modified, Cache-Control, conditional
+    requests (304) and single byte ranges (206/416), for GET and HEAD.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = await content_etag(path, stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since"), stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type or media_type_for(path)
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+
+    start, end = 0, size - 1
+    status_code = 200
+    range_header = request.headers.get("range")
+    if range_header and size and _if_range_current(request.headers.get("if-range"), etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(_file_chunks(path, start, length), status_code=status_code, headers=headers, media_type=media_type)
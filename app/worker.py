@@ -0,0 +1,131 @@
+"""
+Separation worker pool.
+
+Claims pending jobs from the `jobs` table and runs them outside the API process.
+Start it next to the API (with JOB_EXECUTION_MODE=worker set on both):
+
+    python -m app.worker
+"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CORES_PER_JOB = max(1, int(os.getenv("WORKER_CORES_PER_JOB", "2")))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "0")) or max(1, (os.cpu_count() or 1) // CORES_PER_JOB)
+POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+RECOVERY_SECONDS = float(os.getenv("WORKER_RECOVERY_SECONDS", "30"))
+
+
+def _heartbeat_loop(job_id, worker_id, stop):
+    from .database import SessionLocal
+    from .services import job_queue
+
+    while not stop.wait(job_queue.HEARTBEAT_SECONDS):
+        db = SessionLocal()
+        try:
+            job_queue.heartbeat(db, job_id, worker_id)
+        except Exception as e:
+            print(f"[WORKER] Heartbeat failed for job {job_id}: {e}")
+        finally:
+            db.close()
+
+
+def run_worker(index):
+    # Imported here so the supervisor process never loads the separation stack
+    from .database import SessionLocal
+    from .services import job_queue
+    from .services.audio_service import process_audio_job
+    from .services.metrics import metrics
+
+    # No HTTP server here: the API's /metrics merges these snapshots into its scrape
+    metrics.start_snapshot_writer()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"[WORKER] {worker_id} started (slot {index})")
+
+    while True:
+        db = SessionLocal()
+        try:
+            job = job_queue.claim_next_job(db, worker_id)
+            claimed = (job.id, job.input_path, bool(job.high_quality)) if job else None
+        except Exception as e:
+            print(f"[WORKER] {worker_id} failed to claim a job: {e}")
+            claimed = None
+        finally:
+            db.close()
+
+        if not claimed:
+            time.sleep(POLL_SECONDS)
+            continue
+
+        job_id, input_path, high_quality = claimed
+        print(f"[WORKER] {worker_id} claimed job {job_id}")
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat_loop, args=(job_id, worker_id, stop), daemon=True)
+        beat.start()
+        try:
+            asyncio.run(process_audio_job(job_id, input_path, high_quality))
+        finally:
+            stop.set()
+            beat.join()
+
+        db = SessionLocal()
+        try:
+            job_queue.finish_attempt(db, job_id, worker_id)
+        finally:
+            db.close()
+
+
+def main():
+    from .database import SessionLocal
+    from .services import job_queue
+
+    # Keep each worker's torch/onnx thread pools to its share of the cores
+    os.environ.setdefault("OMP_NUM_THREADS", str(CORES_PER_JOB))
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+    print(f"[WORKER] Starting {WORKER_CONCURRENCY} worker processes ({CORES_PER_JOB} cores per job)")
+
+    last_recovery = 0.0
+    try:
+        while True:
+            for index in range(WORKER_CONCURRENCY):
+                proc = processes.get(index)
+                if proc is None or not proc.is_alive():
+                    if proc is not None:
+                        print(f"[WORKER] Slot {index} exited with code {proc.exitcode}, restarting")
+                    # Not daemonic: workers may fan out into their own process pools
+                    proc = ctx.Process(target=run_worker, args=(index,))
+                    proc.start()
+                    processes[index] = proc
+
+            if time.monotonic() - last_recovery >= RECOVERY_SECONDS:
+                last_recovery = time.monotonic()
+                db = SessionLocal()
+                try:
+                    job_queue.recover_stale_jobs(db)
+                except Exception as e:
+                    print(f"[WORKER] Stale job recovery failed: {e}")
+                finally:
+                    db.close()
+
+            time.sleep(1)
+    finally:
+        # Jobs held by terminated workers are picked up again by stale recovery
+        for proc in processes.values():
+            proc.terminate()
+        for proc in processes.values():
+            proc.join()
+
+
+if __name__ == "__main__":
+    main()
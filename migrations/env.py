@@ -26,6 +26,8 @@ sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..'
 from app.database import Base
 from app.models.job import Job
 from app.models.user import User
+from app.models.stem_cache import StemCacheEntry
+from app.models.analysis import AnalysisResult
 
 target_metadata = Base.metadata
 
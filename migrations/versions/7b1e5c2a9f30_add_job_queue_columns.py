@@ -0,0 +1,36 @@
+"""Add job queue columns
+
+Revision ID: 7b1e5c2a9f30
+Revises: 4d0bcd878a07
+Create Date: 2026-10-18 09:12:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b1e5c2a9f30'
+down_revision: Union[str, None] = '4d0bcd878a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs', sa.Column('input_path', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('high_quality', sa.Boolean(), nullable=True))
+    op.add_column('jobs', sa.Column('attempts', sa.Integer(), server_default='0', nullable=True))
+    op.add_column('jobs', sa.Column('worker_id', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f('ix_jobs_status'), 'jobs', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_jobs_status'), table_name='jobs')
+    op.drop_column('jobs', 'heartbeat_at')
+    op.drop_column('jobs', 'worker_id')
+    op.drop_column('jobs', 'attempts')
+    op.drop_column('jobs', 'high_quality')
+    op.drop_column('jobs', 'input_path')
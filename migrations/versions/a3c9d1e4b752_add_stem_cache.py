@@ -0,0 +1,48 @@
+"""Add stem cache
+
+Revision ID: a3c9d1e4b752
+Revises: 7b1e5c2a9f30
+Create Date: 2026-10-18 10:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c9d1e4b752'
+down_revision: Union[str, None] = '7b1e5c2a9f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('stem_cache',
+    sa.Column('cache_key', sa.String(), nullable=False),
+    sa.Column('audio_hash', sa.String(), nullable=False),
+    sa.Column('models', sa.String(), nullable=False),
+    sa.Column('high_quality', sa.Boolean(), nullable=True),
+    sa.Column('source_job_id', sa.Integer(), nullable=False),
+    sa.Column('stems', sa.JSON(), nullable=False),
+    sa.Column('stems_dir', sa.String(), nullable=False),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=True),
+    sa.Column('evicted', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('last_used_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('cache_key')
+    )
+    op.create_index(op.f('ix_stem_cache_audio_hash'), 'stem_cache', ['audio_hash'], unique=False)
+    op.add_column('jobs', sa.Column('audio_hash', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('cache_key', sa.String(), nullable=True))
+    op.create_index(op.f('ix_jobs_audio_hash'), 'jobs', ['audio_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_jobs_audio_hash'), table_name='jobs')
+    op.drop_column('jobs', 'cache_key')
+    op.drop_column('jobs', 'audio_hash')
+    op.drop_index(op.f('ix_stem_cache_audio_hash'), table_name='stem_cache')
+    op.drop_table('stem_cache')
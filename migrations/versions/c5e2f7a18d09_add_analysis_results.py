@@ -0,0 +1,41 @@
+"""Add analysis results
+
+Revision ID: c5e2f7a18d09
+Revises: a3c9d1e4b752
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e2f7a18d09'
+down_revision: Union[str, None] = 'a3c9d1e4b752'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('analysis_results',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('stem', sa.String(), nullable=False),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('params_key', sa.String(), nullable=False),
+    sa.Column('result', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['jobs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('job_id', 'stem', 'kind', 'params_key', name='uq_analysis_results_lookup')
+    )
+    op.create_index(op.f('ix_analysis_results_id'), 'analysis_results', ['id'], unique=False)
+    op.create_index(op.f('ix_analysis_results_job_id'), 'analysis_results', ['job_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_analysis_results_job_id'), table_name='analysis_results')
+    op.drop_index(op.f('ix_analysis_results_id'), table_name='analysis_results')
+    op.drop_table('analysis_results')
@@ -0,0 +1,26 @@
+"""Add job timings
+
+Revision ID: e8f4b2c6d1a3
+Revises: c5e2f7a18d09
+Create Date: 2026-10-18 12:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8f4b2c6d1a3'
+down_revision: Union[str, None] = 'c5e2f7a18d09'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs', sa.Column('timings', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('jobs', 'timings')
@@ -0,0 +1,30 @@
+"""Add job user id
+
+Revision ID: f1a7c3e9b504
+Revises: e8f4b2c6d1a3
+Create Date: 2026-10-18 14:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a7c3e9b504'
+down_revision: Union[str, None] = 'e8f4b2c6d1a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('jobs', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_jobs_user_id'), 'jobs', ['user_id'], unique=False)
+    op.create_foreign_key('fk_jobs_user_id_users', 'jobs', 'users', ['user_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    op.drop_constraint('fk_jobs_user_id_users', 'jobs', type_='foreignkey')
+    op.drop_index(op.f('ix_jobs_user_id'), table_name='jobs')
+    op.drop_column('jobs', 'user_id')
@@ -1,3 +1,11 @@
+-- Create users table (future proofing)
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE,
+    email TEXT UNIQUE,
+    hashed_password TEXT
+);
+
 -- Create jobs table
 CREATE TABLE IF NOT EXISTS jobs (
     id SERIAL PRIMARY KEY,
@@ -7,16 +15,52 @@ CREATE TABLE IF NOT EXISTS jobs (
     created_at TIMESTAMPTZ DEFAULT now(),
     updated_at TIMESTAMPTZ DEFAULT now(),
     stems JSONB, -- Store paths: {"vocals": "...", "drums": "...", ...}
-    error_message TEXT
+    error_message TEXT,
+    timings JSONB, -- Seconds per processing stage
+    -- Durable queue bookkeeping
+    input_path TEXT,
+    high_quality BOOLEAN DEFAULT FALSE,
+    attempts INTEGER DEFAULT 0,
+    worker_id TEXT,
+    heartbeat_at TIMESTAMPTZ,
+    -- Fair queuing between users
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    -- Content-addressed result cache
+    audio_hash TEXT,
+    cache_key TEXT
 );
 
--- Create users table (future proofing)
-CREATE TABLE IF NOT EXISTS users (
+-- Completed stem sets keyed by (audio hash, models, quality)
+CREATE TABLE IF NOT EXISTS stem_cache (
+    cache_key TEXT PRIMARY KEY,
+    audio_hash TEXT NOT NULL,
+    models TEXT NOT NULL,
+    high_quality BOOLEAN DEFAULT FALSE,
+    source_job_id INTEGER NOT NULL,
+    stems JSONB NOT NULL,
+    stems_dir TEXT NOT NULL,
+    size_bytes BIGINT DEFAULT 0,
+    ref_count INTEGER DEFAULT 0,
+    evicted BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    last_used_at TIMESTAMPTZ DEFAULT now()
+);
+
+-- Persisted analysis results (chords, ...) per job, stem and parameters
+CREATE TABLE IF NOT EXISTS analysis_results (
     id SERIAL PRIMARY KEY,
-    username TEXT UNIQUE,
-    email TEXT UNIQUE,
-    hashed_password TEXT
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    stem TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    result JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    CONSTRAINT uq_analysis_results_lookup UNIQUE (job_id, stem, kind, params_key)
 );
 
 -- Indexing for performance
 CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_audio_hash ON jobs(audio_hash);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs(user_id);
+CREATE INDEX IF NOT EXISTS idx_analysis_results_job_id ON analysis_results(job_id);
+CREATE INDEX IF NOT EXISTS idx_stem_cache_audio_hash ON stem_cache(audio_hash);
@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+# Point the app at throwaway storage and database before anything imports it
+_ROOT = tempfile.mkdtemp(prefix="forge-audio-tests-")
+os.environ["STORAGE_ROOT"] = os.path.join(_ROOT, "storage")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_ROOT, 'test.db')}"
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    from app.database import Base, SessionLocal, engine
+    import app.models.job  # noqa: F401
+    import app.models.stem_cache  # noqa: F401
+    import app.models.analysis  # noqa: F401
+
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(engine)
@@ -0,0 +1,101 @@
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from app.services.chord_service import OnlineViterbi, chord_service, logsumexp, viterbi_path
+
+
+def _log_probs(rng, n_states=24, n_steps=300):
+    scores = rng.normal(size=(n_states, n_steps)) * 3
+    return scores - logsumexp(scores, axis=0)
+
+
+def _reference_path(log_likelihood, switch_penalty):
+    """Textbook Viterbi over the full states x states transition matrix."""
+    n_states, n_steps = log_likelihood.shape
+    transitions = np.full((n_states, n_states), -switch_penalty)
+    np.fill_diagonal(transitions, 0.0)
+    score = log_likelihood[:, 0].copy()
+    backpointers = np.zeros((n_steps, n_states), dtype=np.intp)
+    for t in range(1, n_steps):
+        candidates = score[:, None] + transitions
+        backpointers[t] = candidates.argmax(axis=0)
+        score = candidates.max(axis=0) + log_likelihood[:, t]
+    path = [int(score.argmax())]
+    for t in range(n_steps - 1, 0, -1):
+        path.append(int(backpointers[t, path[-1]]))
+    return np.array(path[::-1])
+
+
+def _decode_online(log_likelihood, switch_penalty, block, max_lag=10_000):
+    decoder = OnlineViterbi(log_likelihood.shape[0], switch_penalty, max_lag)
+    committed = []
+    for start in range(0, log_likelihood.shape[1], block):
+        committed += decoder.push(log_likelihood[:, start:start + block])
+    committed += decoder.finish()
+    return np.array([state for state, _ in committed])
+
+
+@pytest.mark.parametrize("penalty", [0.5, 4.0, 8.0])
+def test_viterbi_path_matches_full_transition_matrix(penalty):
+    log_probs = _log_probs(np.random.default_rng(0))
+
+    assert np.array_equal(viterbi_path(log_probs, penalty), _reference_path(log_probs, penalty))
+
+
+def test_viterbi_path_without_penalty_is_framewise_argmax():
+    log_probs = _log_probs(np.random.default_rng(1))
+
+    assert np.array_equal(viterbi_path(log_probs, 0.0), log_probs.argmax(axis=0))
+
+
+def test_switch_penalty_absorbs_short_flicker():
+    log_probs = np.log(np.full((2, 9), 0.1))
+    log_probs[0] = np.log(0.9)
+    log_probs[:, 4] = np.log([0.4, 0.6])
+
+    assert viterbi_path(log_probs, 0.0)[4] == 1
+    assert not viterbi_path(log_probs, 2.0).any()
+
+
+@pytest.mark.parametrize("block", [1, 7, 64, 300])
+def test_online_decoding_matches_offline(block):
+    log_probs = _log_probs(np.random.default_rng(2))
+
+    assert np.array_equal(_decode_online(log_probs, 4.0, block), viterbi_path(log_probs, 4.0))
+
+
+def test_online_decoding_with_short_lag_covers_every_step():
+    log_probs = _log_probs(np.random.default_rng(3), n_states=4)
+    decoder = OnlineViterbi(4, 0.5, max_lag=5)
+
+    committed = decoder.push(log_probs)
+    # Never more than max_lag steps held back
+    assert len(decoder.backpointers) <= 5
+    committed += decoder.finish()
+
+    assert len(committed) == log_probs.shape[1]
+    assert all(log_prob == log_probs[state, t] for t, (state, log_prob) in enumerate(committed))
+
+
+def _chord(frequencies, seconds, sr):
+    t = np.arange(int(seconds * sr)) / sr
+    return sum(np.sin(2 * np.pi * f * t) for f in frequencies) / len(frequencies)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="detect_chords decodes through ffmpeg")
+def test_streaming_and_offline_detection_agree(tmp_path):
+    sr = 22050
+    c_major = (261.63, 329.63, 392.00)
+    a_minor = (220.00, 261.63, 329.63)
+    path = str(tmp_path / "progression.wav")
+    sf.write(path, np.concatenate([_chord(c_major, 4, sr), _chord(a_minor, 4, sr)]).astype("float32") * 0.5, sr)
+
+    streamed = list(chord_service.stream_chords(path, block_seconds=1))
+    offline = chord_service.detect_chords(path)
+
+    assert [segment["chord"] for segment in streamed] == ["C", "Am"]
+    assert [segment["chord"] for segment in offline] == ["C", "Am"]
+    assert streamed[1]["time"] == pytest.approx(offline[1]["time"], abs=0.5)
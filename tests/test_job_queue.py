@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+import pytest
+
+from app.models.job import Job
+from app.services import job_queue
+
+
+@pytest.fixture
+def published(monkeypatch):
+    snapshots = []
+    monkeypatch.setattr(job_queue.job_events, "publish", snapshots.append)
+    return snapshots
+
+
+@pytest.fixture
+def worker_mode(monkeypatch):
+    monkeypatch.setattr(job_queue, "EXECUTION_MODE", "worker")
+    monkeypatch.setattr(job_queue, "MAX_ATTEMPTS", 2)
+
+
+def _pending_job(db):
+    job = Job(filename="song.wav", status="pending", input_path="/tmp/song.wav")
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_failed_attempt_is_requeued_without_error(db, worker_mode):
+    job = _pending_job(db)
+    claimed = job_queue.claim_next_job(db, "worker-a")
+    assert claimed.attempts == 1
+
+    assert job_queue.fail_attempt(claimed, "Error during separation: boom") is True
+    db.commit()
+    db.refresh(claimed)
+    assert claimed.status == "pending"
+    assert claimed.error_message is None
+    assert claimed.worker_id is None
+
+
+def test_last_attempt_fails_with_error(db, worker_mode):
+    job = _pending_job(db)
+    for attempt in (1, 2):
+        claimed = job_queue.claim_next_job(db, f"worker-{attempt}")
+        retried = job_queue.fail_attempt(claimed, "Error during separation: boom")
+        db.commit()
+
+    assert retried is False
+    db.refresh(claimed)
+    assert claimed.status == "failed"
+    assert claimed.attempts == 2
+    assert claimed.error_message == "Error during separation: boom"
+
+
+def test_inline_jobs_are_not_retried(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "EXECUTION_MODE", "inline")
+    job = _pending_job(db)
+    assert job_queue.fail_attempt(job, "boom") is False
+    assert job.status == "failed"
+
+
+def test_finish_attempt_leaves_another_workers_claim(db, worker_mode):
+    job = _pending_job(db)
+    first = job_queue.claim_next_job(db, "worker-a")
+    job_queue.fail_attempt(first, "boom")
+    db.commit()
+    second = job_queue.claim_next_job(db, "worker-b")
+    assert second.id == job.id
+
+    # worker-a finishing its (failed) attempt late must not release worker-b's claim
+    job_queue.finish_attempt(db, job.id, "worker-a")
+    db.refresh(second)
+    assert second.worker_id == "worker-b"
+    assert second.status == "processing"
+
+    job_queue.finish_attempt(db, job.id, "worker-b")
+    db.refresh(second)
+    assert second.worker_id is None
+
+
+def test_stale_jobs_publish_only_final_failures(db, worker_mode, published):
+    job = _pending_job(db)
+    claimed = job_queue.claim_next_job(db, "worker-a")
+    claimed.heartbeat_at = job_queue._now() - timedelta(seconds=job_queue.STALE_AFTER_SECONDS + 1)
+    db.commit()
+
+    assert job_queue.recover_stale_jobs(db) == 1
+    assert [s["status"] for s in published] == ["pending"]
+    assert published[0]["error"] is None
+
+    claimed = job_queue.claim_next_job(db, "worker-b")
+    claimed.heartbeat_at = job_queue._now() - timedelta(seconds=job_queue.STALE_AFTER_SECONDS + 1)
+    db.commit()
+    job_queue.recover_stale_jobs(db)
+    assert published[-1]["status"] == "failed"
+    assert published[-1]["error"] == "Worker lost after 2 attempts"
@@ -0,0 +1,47 @@
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+from app.services import metrics as metrics_module
+from app.services.metrics import METRICS_DIR, RETAINED_TOTALS_FILENAME, MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    registry = MetricsRegistry()
+    registry.counter("jobs_total", "Jobs", ["status"])
+    registry.gauge("queue_depth", "Queued jobs")
+    yield registry
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+
+def _write_snapshot(name, written_at, jobs, depth):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump({"written_at": written_at, "metrics": {"jobs_total": [[["failed"], jobs]], "queue_depth": [[[], depth]]}}, f)
+    return path
+
+
+def test_exited_worker_snapshots_are_compacted_without_losing_totals(registry):
+    now = time.time()
+    exited = _write_snapshot("host-1", now - metrics_module.METRICS_SNAPSHOT_RETENTION_SECONDS - 60, jobs=3, depth=7)
+    live = _write_snapshot("host-2", now, jobs=2, depth=4)
+
+    first = registry.collect()
+    assert first["jobs_total"] == {("failed",): 5}
+    # Only the live worker's gauge counts
+    assert first["queue_depth"] == {(): 4}
+    assert not os.path.exists(exited)
+    assert os.path.exists(live)
+    assert os.path.exists(os.path.join(METRICS_DIR, RETAINED_TOTALS_FILENAME))
+
+    # Compaction is invisible to the next scrape, and later exits add to the retained totals
+    assert registry.collect()["jobs_total"] == {("failed",): 5}
+    _write_snapshot("host-3", now - metrics_module.METRICS_SNAPSHOT_RETENTION_SECONDS - 60, jobs=1, depth=0)
+    assert registry.collect()["jobs_total"] == {("failed",): 6}
+    assert sorted(os.listdir(METRICS_DIR)) == [".lock", "host-2.json", RETAINED_TOTALS_FILENAME]
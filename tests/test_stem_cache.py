@@ -0,0 +1,101 @@
+import os
+
+from app.models.job import Job
+from app.models.stem_cache import StemCacheEntry
+from app.services.lifecycle import lifecycle_collector
+from app.services.stem_cache import StemCache, make_key, stem_cache
+from app.services.storage import storage
+
+CACHE_KEY = make_key("abc123", ["htdemucs_6s.yaml"], False)
+
+
+def _separated_job(db, name="song.wav"):
+    job = Job(filename=name, status="completed", audio_hash="abc123")
+    db.add(job)
+    db.commit()
+    stems_dir = storage.job_dir(job.id)
+    os.makedirs(stems_dir, exist_ok=True)
+    with open(os.path.join(stems_dir, "song_(Vocals).wav"), "wb") as f:
+        f.write(b"\0" * 1024)
+    job.stems = {"Vocals": f"/stems/{job.id}/song_(Vocals).wav"}
+    db.commit()
+    return job, stems_dir
+
+
+def _duplicate_job(db, cache):
+    job = Job(filename="copy.wav", status="pending", audio_hash="abc123")
+    db.add(job)
+    db.flush()
+    assert cache.attach(db, job, CACHE_KEY)
+    job.status = "completed"
+    db.commit()
+    return job
+
+
+def _entry(db):
+    return db.query(StemCacheEntry).filter(StemCacheEntry.cache_key == CACHE_KEY).first()
+
+
+def test_going_over_budget_reclaims_disk(db):
+    cache = StemCache(max_bytes=1 << 30)
+    owner, stems_dir = _separated_job(db)
+    cache.store(db, owner, CACHE_KEY, stems_dir)
+    duplicate = _duplicate_job(db, cache)
+    usage = storage.usage(refresh=True)
+
+    cache.max_bytes = 0
+    cache.enforce_budget(db)
+    assert not os.path.exists(stems_dir)
+    assert storage.usage(refresh=True) < usage
+    assert _entry(db) is None
+    for job in (owner, duplicate):
+        db.refresh(job)
+        assert job.status == "expired"
+
+
+def test_eviction_waits_for_running_jobs_to_release(db):
+    cache = StemCache(max_bytes=1 << 30)
+    owner, stems_dir = _separated_job(db)
+    cache.store(db, owner, CACHE_KEY, stems_dir)
+    duplicate = _duplicate_job(db, cache)
+    duplicate.status = "processing"
+    db.commit()
+    assert _entry(db).ref_count == 2
+
+    cache.max_bytes = 0
+    cache.enforce_budget(db)
+    entry = _entry(db)
+    assert entry.evicted
+    # Still referenced by both jobs
+    assert os.path.isdir(stems_dir)
+
+    cache.release(db, CACHE_KEY)
+    assert os.path.isdir(stems_dir)
+    cache.release(db, CACHE_KEY)
+    assert not os.path.exists(stems_dir)
+    assert _entry(db) is None
+
+
+def test_expiring_stem_dir_releases_cache_references(db):
+    owner, stems_dir = _separated_job(db)
+    stem_cache.store(db, owner, CACHE_KEY, stems_dir)
+    duplicate = _duplicate_job(db, stem_cache)
+
+    assert lifecycle_collector.expire_stem_dir(db, stems_dir)
+    assert not os.path.exists(stems_dir)
+    assert _entry(db) is None
+    for job in (owner, duplicate):
+        db.refresh(job)
+        assert job.status == "expired"
+        assert job.stems is None
+
+
+def test_expiry_purges_entry_with_drifted_count(db):
+    owner, stems_dir = _separated_job(db)
+    stem_cache.store(db, owner, CACHE_KEY, stems_dir)
+    _entry(db).ref_count = 5
+    db.commit()
+
+    assert lifecycle_collector.expire_stem_dir(db, stems_dir)
+    assert not os.path.exists(stems_dir)
+    assert _entry(db) is None